@@ -0,0 +1,172 @@
+"""
+Admission control for /predict.
+
+A late robot command is worse than a dropped one, so instead of letting
+requests pile up behind the model under a burst, every prediction has to be
+admitted first:
+
+- per device token bucket (RATE per second, BURST at once), else 429
+- at most MAX_IN_FLIGHT predictions run at once and at most MAX_QUEUE wait
+  for a slot, else 503
+- a request older than MAX_AGE_MS is shed (503) instead of waiting for or
+  taking a slot; its age is the time it waited here plus how much later than
+  usual it arrived from its device (the page sends its clock, and the
+  smallest server - device clock difference seen is taken as "no delay")
+
+Rejections raise Shed with a Retry-After hint; metrics() reports admitted
+and shed counts and queue wait times for /metrics.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+MAX_IN_FLIGHT = 2
+MAX_QUEUE = 8
+MAX_AGE_MS = 500
+RATE = 5.0  # predictions per second and device
+BURST = 10
+MAX_DEVICES = 4096
+CLOCK_DRIFT_MS_PER_S = 1.0  # how fast the best-case clock offset may creep up
+WAIT_SAMPLES = 1000  # recent queue waits kept for percentiles
+
+
+class Shed(Exception):
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeviceState:
+    def __init__(self, now, tokens):
+        self.tokens = tokens
+        self.refilled = now
+        self.min_offset = None
+        self.offset_seen = now
+
+
+class Ticket:
+    def __init__(self, arrived, age_ms):
+        self.arrived = arrived
+        self.age_ms = age_ms  # age when it arrived here
+
+    def expired(self, max_age_ms=MAX_AGE_MS):
+        """True once the request is too old for its result to be acted on."""
+        return self.age_ms + (time.monotonic() - self.arrived) * 1000 > max_age_ms
+
+
+class AdmissionController:
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, max_queue=MAX_QUEUE, max_age_ms=MAX_AGE_MS,
+                 rate=RATE, burst=BURST):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_age_ms = max_age_ms
+        self.rate = rate
+        self.burst = burst
+        self.devices = OrderedDict()
+        self.in_flight = 0
+        self.waiting = 0
+        self.cond = threading.Condition()
+        self.admitted = 0
+        self.shed = {"rate": 0, "queue_full": 0, "deadline": 0, "late": 0}
+        self.waits_ms = deque(maxlen=WAIT_SAMPLES)
+        self.max_wait_ms = 0.0
+
+    def _device(self, device, now):
+        # caller holds self.cond
+        state = self.devices.get(device)
+        if state is None:
+            state = self.devices[device] = DeviceState(now, self.burst)
+            if len(self.devices) > MAX_DEVICES:
+                self.devices.popitem(last=False)
+        self.devices.move_to_end(device)
+        return state
+
+    def _network_delay_ms(self, state, now, sent_at_ms):
+        """How much later than the device's best case this request arrived."""
+        if sent_at_ms is None:
+            return 0.0
+        offset = time.time() * 1000 - sent_at_ms
+        if state.min_offset is not None:
+            state.min_offset += (now - state.offset_seen) * CLOCK_DRIFT_MS_PER_S
+        state.offset_seen = now
+        if state.min_offset is None or offset < state.min_offset:
+            state.min_offset = offset
+        return offset - state.min_offset
+
+    def _shed(self, reason, status, retry_after):
+        self.shed[reason] += 1
+        raise Shed(status, reason, retry_after)
+
+    def _retry_after(self):
+        return max(self.max_age_ms / 1000, 0.1)
+
+    def admit(self, device, sent_at_ms=None):
+        """Wait for a slot. Returns a Ticket, raises Shed if the request can't be served in time."""
+        arrived = time.monotonic()
+        with self.cond:
+            state = self._device(device, arrived)
+            state.tokens = min(self.burst, state.tokens + (arrived - state.refilled) * self.rate)
+            state.refilled = arrived
+            if state.tokens < 1:
+                self._shed("rate", 429, (1 - state.tokens) / self.rate)
+            state.tokens -= 1
+
+            ticket = Ticket(arrived, self._network_delay_ms(state, arrived, sent_at_ms))
+            if ticket.age_ms > self.max_age_ms:
+                self._shed("deadline", 503, 0)
+            if self.in_flight >= self.max_in_flight or self.waiting:
+                if self.waiting >= self.max_queue:
+                    self._shed("queue_full", 503, self._retry_after())
+                deadline = arrived + (self.max_age_ms - ticket.age_ms) / 1000
+                self.waiting += 1
+                try:
+                    while self.in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed("deadline", 503, self._retry_after())
+                        self.cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.in_flight += 1
+            self.admitted += 1
+            wait_ms = (time.monotonic() - arrived) * 1000
+            self.waits_ms.append(wait_ms)
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        return ticket
+
+    def release(self):
+        with self.cond:
+            self.in_flight -= 1
+            # all of them: a woken waiter may be past its deadline and give up
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, device, sent_at_ms=None):
+        ticket = self.admit(device, sent_at_ms)
+        try:
+            yield ticket
+        finally:
+            self.release()
+
+    def late(self):
+        """Count a prediction that finished too late to drive the robots."""
+        with self.cond:
+            self.shed["late"] += 1
+
+    def metrics(self):
+        with self.cond:
+            waits = sorted(self.waits_ms)
+            return {
+                "admitted": self.admitted, "shed": dict(self.shed),
+                "in_flight": self.in_flight, "queued": self.waiting,
+                "limits": {"max_in_flight": self.max_in_flight, "max_queue": self.max_queue,
+                           "max_age_ms": self.max_age_ms, "rate": self.rate, "burst": self.burst},
+                "queue_wait_ms": {
+                    "p50": waits[len(waits) // 2] if waits else None,
+                    "p95": waits[int(len(waits) * 0.95)] if waits else None,
+                    "max": self.max_wait_ms,
+                },
+            }
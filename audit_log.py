@@ -0,0 +1,168 @@
+"""
+Prediction audit log, written off the request path.
+
+Every prediction (label, full probability vector, latency, device, and
+optionally a hash of the input window) is appended as one JSON line to
+audit/predictions.<pid>.jsonl, one file per server process so no two
+writers ever share (or rotate) a file. Requests only put a record on a
+bounded queue; a background thread writes them in batches and rotates the
+file like logging's RotatingFileHandler (predictions.<pid>.jsonl.1, .2,
+...). When the writer can't keep up, new records are dropped and counted
+rather than slowing down predictions.
+
+    python audit_log.py audit   # label counts and confidence over all files
+"""
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+
+AUDIT_FILE = os.path.join("audit", "predictions.jsonl")
+MAX_QUEUE = 10000
+BATCH_SIZE = 256
+FLUSH_INTERVAL = 1.0  # seconds a record may wait for its batch
+MAX_BYTES = 16 * 1024 * 1024
+BACKUP_COUNT = 5
+
+
+def window_hash(window):
+    return hashlib.blake2b(window.tobytes(), digest_size=8).hexdigest()
+
+
+def process_path(path, pid=None):
+    """audit/predictions.jsonl -> audit/predictions.<pid>.jsonl"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid() if pid is None else pid}{ext}"
+
+
+def _json_default(value):
+    # numpy scalars and arrays from the model
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class AuditLog:
+    def __init__(self, path=AUDIT_FILE, max_queue=MAX_QUEUE, max_bytes=MAX_BYTES, backup_count=BACKUP_COUNT,
+                 hash_windows=False, per_process=True):
+        self.path = process_path(path) if per_process else path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.hash_windows = hash_windows
+        self.queue = queue.Queue(max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.file = None
+        self.thread = threading.Thread(target=self._writer, name="audit-log", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, record, window=None):
+        """Queue one record, never blocks. window: the input array, hashed by the writer if enabled."""
+        record.setdefault("ts", time.time())
+        try:
+            self.queue.put_nowait((record, window))
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "queued": self.queue.qsize()}
+
+    def _writer(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                self._write([item for item in batch if item is not None])
+            except Exception as e:
+                print(f"could not write audit log: {e}")
+            if stop:
+                return
+
+    def _write(self, batch):
+        if not batch:
+            return
+        lines = []
+        for record, window in batch:
+            if window is not None and self.hash_windows:
+                record["window_hash"] = window_hash(window)
+            lines.append(json.dumps(record, default=_json_default))
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        if self.file is None:
+            self._open()
+        if 0 < self.file.tell() and self.file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+            self._open()
+        self.file.write(data)
+        self.file.flush()
+        self.written += len(batch)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "ab")
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self, timeout=5):
+        """Write what is queued and stop the writer."""
+        if not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a prediction audit log.")
+    parser.add_argument("logs", nargs="+", help="log files, or directories to read all of them from")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.logs:
+        if os.path.isdir(path):
+            paths += sorted(os.path.join(path, name) for name in os.listdir(path) if ".jsonl" in name)
+        else:
+            paths.append(path)
+
+    labels = {}
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("event") != "prediction":
+                    continue
+                stats = labels.setdefault(record["label"], {"count": 0, "confidence": 0.0, "latency_ms": 0.0})
+                stats["count"] += 1
+                stats["confidence"] += max(record["probs"].values())
+                stats["latency_ms"] += record.get("latency_ms") or 0.0
+    for label, stats in sorted(labels.items()):
+        print(f"  {label:15s} {stats['count']:6d} predictions, mean confidence "
+              f"{stats['confidence'] / stats['count']:.3f}, mean latency {stats['latency_ms'] / stats['count']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+On-the-fly augmentation of gesture recordings for model_training.py.
+
+Everything works on whole minibatches at once (shape (batch, 600), i.e. 100
+time steps x [x, y, z, alpha, beta, gamma] flattened the same way as the
+training data), so augmenting a batch costs a handful of NumPy calls and never
+becomes the bottleneck of a training step. Nothing is written to disk; every
+epoch sees freshly augmented copies.
+"""
+import numpy as np
+
+TIME_STEPS = 100
+FEATURES = 6
+
+
+def time_warp(batch, rng, strength=0.08):
+    """
+    Smoothly speed up / slow down parts of each recording. The start and end
+    stay in place; strength is the largest shift as a fraction of the window.
+    """
+    n, steps, _ = batch.shape
+    grid = np.linspace(0.0, 1.0, steps)
+    shift = rng.uniform(-strength, strength, size=(n, 1)) * np.sin(np.pi * grid)
+    pos = np.clip(grid + shift, 0.0, 1.0) * (steps - 1)
+    low = np.floor(pos).astype(np.int64)
+    high = np.minimum(low + 1, steps - 1)
+    t = (pos - low)[:, :, np.newaxis].astype(batch.dtype)
+    low_vals = np.take_along_axis(batch, low[:, :, np.newaxis], axis=1)
+    high_vals = np.take_along_axis(batch, high[:, :, np.newaxis], axis=1)
+    return low_vals * (1 - t) + high_vals * t
+
+
+def scale_amplitude(batch, rng, sigma=0.1):
+    """Random per-recording, per-axis gain around 1."""
+    return batch * rng.normal(1.0, sigma, size=(batch.shape[0], 1, FEATURES)).astype(batch.dtype)
+
+
+def add_noise(batch, rng, sigma=0.01):
+    return batch + sigma * rng.standard_normal(size=batch.shape, dtype=np.float32).astype(batch.dtype, copy=False)
+
+
+def rotation_matrices(angles):
+    """angles: (n, 3) radians around x, y, z -> (n, 3, 3) rotation matrices."""
+    cx, cy, cz = np.cos(angles).T
+    sx, sy, sz = np.sin(angles).T
+    one, zero = np.ones_like(cx), np.zeros_like(cx)
+    rx = np.stack([one, zero, zero, zero, cx, -sx, zero, sx, cx], axis=1).reshape(-1, 3, 3)
+    ry = np.stack([cy, zero, sy, zero, one, zero, -sy, zero, cy], axis=1).reshape(-1, 3, 3)
+    rz = np.stack([cz, -sz, zero, sz, cz, zero, zero, zero, one], axis=1).reshape(-1, 3, 3)
+    return rz @ ry @ rx
+
+
+def rotate(batch, rng, max_degrees=10.0):
+    """
+    Tilt each recording by a small random rotation, as if the phone was held
+    slightly differently. devicemotion reports rotation rate alpha/beta/gamma
+    around the z/x/y axes, so the rate vector is (beta, gamma, alpha).
+    """
+    angles = np.radians(rng.uniform(-max_degrees, max_degrees, size=(batch.shape[0], 3)))
+    # row vectors, so multiply by the transposed matrices
+    rt = rotation_matrices(angles).astype(batch.dtype).transpose(0, 2, 1)
+    out = np.empty_like(batch)
+    out[:, :, 0:3] = batch[:, :, 0:3] @ rt
+    out[:, :, [4, 5, 3]] = batch[:, :, [4, 5, 3]] @ rt
+    return out
+
+
+def swap_axes(batch, rng, probability=0.2):
+    """
+    Apply correctAxes' Android remapping (y, z) -> (-z, y), or its inverse,
+    to some recordings so the model doesn't depend on which platform
+    recorded the data.
+    """
+    n = batch.shape[0]
+    choice = rng.random(n)
+    forward = choice < probability / 2
+    inverse = (choice >= probability / 2) & (choice < probability)
+    out = batch.copy()
+    out[forward, :, 1], out[forward, :, 2] = -batch[forward, :, 2], batch[forward, :, 1]
+    out[inverse, :, 1], out[inverse, :, 2] = batch[inverse, :, 2], -batch[inverse, :, 1]
+    return out
+
+
+class GestureAugmenter:
+    """Callable applying the whole augmentation chain to a flat (n, 600) batch."""
+
+    def __init__(self, warp=0.08, scale=0.1, noise=0.01, rotation=10.0, swap=0.2, seed=None):
+        self.warp = warp
+        self.scale = scale
+        self.noise = noise
+        self.rotation = rotation
+        self.swap = swap
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, flat):
+        batch = flat.reshape(-1, TIME_STEPS, FEATURES)
+        if self.warp:
+            batch = time_warp(batch, self.rng, self.warp)
+        if self.rotation:
+            batch = rotate(batch, self.rng, self.rotation)
+        if self.swap:
+            batch = swap_axes(batch, self.rng, self.swap)
+        if self.scale:
+            batch = scale_amplitude(batch, self.rng, self.scale)
+        if self.noise:
+            batch = add_noise(batch, self.rng, self.noise)
+        return batch.reshape(flat.shape)
+
+
+def augmented_batches(X, y, batch_size, augmenter):
+    """
+    One epoch of shuffled, augmented (X, y) minibatches. Call again for the
+    next epoch; the augmenter's random state carries over.
+    """
+    order = augmenter.rng.permutation(len(X))
+    for start in range(0, len(X), batch_size):
+        idx = order[start:start + batch_size]
+        yield augmenter(X[idx]), y[idx]
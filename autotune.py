@@ -0,0 +1,231 @@
+"""
+Find the fastest thread setup on this machine and save it for the servers.
+
+    python autotune.py [--model gesture_model.h5] [--duration 3] [--only serving|training]
+
+Serving: for the server's number of worker processes (--workers, 1 by
+default: keyboard overrides, acks and admission limits only work within one
+process), every TensorFlow intra-op thread count that fits the cores is
+tried, with that many processes classifying at the same time the way the
+server does (a direct model call), first single windows, then batches of
+SERVE_BATCH. The most batch-1 predictions per second wins; of the thread
+counts within TOLERANCE of it, the smallest.
+
+Training: model.fit on random data of the model's shape for every
+intra-op / inter-op combination, the most samples per second wins.
+
+Every measurement runs in fresh processes, TensorFlow's thread pools can't
+be resized once they exist. The result goes to thread_config.json, which
+the detection server and model_training.py pick up at startup (see
+thread_config.py). The worker count is never chosen for you.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from thread_config import THREAD_CONFIG_FILE, BLAS_VARIABLES, cpu_count, load
+
+MODEL_FILE = "gesture_model.h5"
+DURATION = 3.0  # seconds per measurement
+SERVE_BATCH = 32
+TRAIN_BATCH = 16  # model_training.BATCH_SIZE
+TRAIN_SAMPLES = 2048
+TOLERANCE = 0.05
+
+
+def powers_of_two(limit):
+    values, n = [], 1
+    while n <= limit:
+        values.append(n)
+        n *= 2
+    if values[-1] != limit:
+        values.append(limit)
+    return values
+
+
+def serving_candidates(cpus, workers):
+    return [{"workers": workers, "intra_op": t, "inter_op": 1, "blas": 1}
+            for t in powers_of_two(max(cpus // workers, 1))]
+
+
+def training_candidates(cpus):
+    return [{"intra_op": t, "inter_op": i, "blas": t}
+            for t in powers_of_two(cpus) for i in ([1, 2] if cpus > 1 else [1])]
+
+
+def child_env(candidate):
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="2",
+               TF_NUM_INTRAOP_THREADS=str(candidate["intra_op"]),
+               TF_NUM_INTEROP_THREADS=str(candidate["inter_op"]))
+    for name in BLAS_VARIABLES:
+        env[name] = str(candidate["blas"])
+    return env
+
+
+def run_processes(mode, candidate, count, args):
+    """
+    Start count measuring processes, let them load the model, then start
+    them all at once. Returns their results.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--measure", mode,
+               "--model", args.model, "--duration", str(args.duration)]
+    processes = []
+    try:
+        for _ in range(count):
+            log = tempfile.TemporaryFile()
+            p = subprocess.Popen(command, env=child_env(candidate), stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE, stderr=log, text=True)
+            processes.append((p, log))
+        for p, log in processes:
+            if p.stdout.readline().strip() != "ready":
+                raise RuntimeError(failure(p, log))
+        for p, _ in processes:
+            p.stdin.write("go\n")
+            p.stdin.flush()
+        results = []
+        for p, log in processes:
+            line = p.stdout.readline()
+            if p.wait() != 0 or not line:
+                raise RuntimeError(failure(p, log))
+            results.append(json.loads(line))
+        return results
+    finally:
+        for p, log in processes:
+            if p.poll() is None:
+                p.kill()
+            log.close()
+
+
+def failure(process, log):
+    process.kill()
+    process.wait()
+    log.seek(0)
+    return "measuring process failed:\n" + log.read().decode(errors="replace")[-2000:]
+
+
+def tune_serving(args, cpus):
+    print(f"Serving, {cpus} cores, {args.workers} worker processes: intra-op threads per worker")
+    print(f"  {'workers':>7s} {'intra':>5s} {'batch-1/s':>10s} {'p50 ms':>7s} {'per core':>9s} "
+          f"{f'batch-{SERVE_BATCH}/s':>12s}")
+    measured = []
+    for candidate in serving_candidates(cpus, args.workers):
+        results = run_processes("serving", candidate, candidate["workers"], args)
+        cores = candidate["workers"] * candidate["intra_op"]
+        row = dict(candidate,
+                   single_per_s=sum(r["single_per_s"] for r in results),
+                   single_p50_ms=max(r["single_p50_ms"] for r in results),
+                   batched_per_s=sum(r["batched_per_s"] for r in results))
+        row["per_core"] = row["single_per_s"] / cores
+        measured.append(row)
+        print(f"  {row['workers']:7d} {row['intra_op']:5d} {row['single_per_s']:10.1f} {row['single_p50_ms']:7.2f} "
+              f"{row['per_core']:9.1f} {row['batched_per_s']:12.1f}")
+    best = max(r["single_per_s"] for r in measured)
+    good = [r for r in measured if r["single_per_s"] >= (1 - TOLERANCE) * best]
+    chosen = min(good, key=lambda r: (r["intra_op"], -r["single_per_s"]))
+    batched = max(measured, key=lambda r: r["batched_per_s"])
+    print(f"  -> {chosen['intra_op']} intra-op threads per worker "
+          f"(batched predictions are fastest with {batched['intra_op']})")
+    return {key: chosen[key] for key in ("workers", "intra_op", "inter_op", "blas")}, measured
+
+
+def tune_training(args, cpus):
+    print(f"Training, {cpus} cores: intra-op x inter-op threads")
+    print(f"  {'intra':>5s} {'inter':>5s} {'samples/s':>10s}")
+    measured = []
+    for candidate in training_candidates(cpus):
+        result, = run_processes("training", candidate, 1, args)
+        row = dict(candidate, samples_per_s=result["samples_per_s"])
+        measured.append(row)
+        print(f"  {row['intra_op']:5d} {row['inter_op']:5d} {row['samples_per_s']:10.1f}")
+    best = max(r["samples_per_s"] for r in measured)
+    good = [r for r in measured if r["samples_per_s"] >= (1 - TOLERANCE) * best]
+    chosen = min(good, key=lambda r: (r["intra_op"], r["inter_op"], -r["samples_per_s"]))
+    print(f"  -> {chosen['intra_op']} intra-op, {chosen['inter_op']} inter-op threads")
+    return {key: chosen[key] for key in ("intra_op", "inter_op", "blas")}, measured
+
+
+def measure(mode, model_file, duration):
+    """Runs in a child process with the thread counts already in its environment."""
+    import numpy as np
+    from tensorflow.keras.models import load_model, clone_model
+
+    model = load_model(model_file)
+    n_in, n_out = model.input_shape[-1], model.output_shape[-1]
+    rng = np.random.default_rng(0)
+    if mode == "serving":
+        single = rng.standard_normal((1, n_in)).astype(np.float32)
+        batch = rng.standard_normal((SERVE_BATCH, n_in)).astype(np.float32)
+        for _ in range(10):
+            model(single, training=False).numpy()
+            model(batch, training=False).numpy()
+    else:
+        model = clone_model(model)
+        model.compile(optimizer="adam", loss="categorical_crossentropy")
+        X = rng.standard_normal((TRAIN_SAMPLES, n_in)).astype(np.float32)
+        y = np.eye(n_out, dtype=np.float32)[rng.integers(0, n_out, TRAIN_SAMPLES)]
+        model.fit(X[:TRAIN_BATCH * 10], y[:TRAIN_BATCH * 10], batch_size=TRAIN_BATCH, epochs=1, verbose=0)
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    if mode == "serving":
+        times = []
+        end = time.perf_counter() + duration / 2
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            model(single, training=False).numpy()
+            times.append(time.perf_counter() - start)
+        batches = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration / 2:
+            model(batch, training=False).numpy()
+            batches += 1
+        batched_seconds = time.perf_counter() - start
+        result = {"single_per_s": len(times) / sum(times), "single_p50_ms": float(np.median(times) * 1000),
+                  "batched_per_s": batches * SERVE_BATCH / batched_seconds}
+    else:
+        samples = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            model.fit(X, y, batch_size=TRAIN_BATCH, epochs=1, verbose=0)
+            samples += len(X)
+        result = {"samples_per_s": samples / (time.perf_counter() - start)}
+    print(json.dumps(result), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark thread settings and save the best to thread_config.json.")
+    parser.add_argument("--model", default=os.environ.get("GESTURE_MODEL_FILE", MODEL_FILE))
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds per measurement")
+    parser.add_argument("--only", choices=["serving", "training"], help="tune only one of them")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server worker processes to tune for (keep 1 for keyboard overrides, acks and admission)")
+    parser.add_argument("--output", default=os.environ.get("THREAD_CONFIG", THREAD_CONFIG_FILE))
+    parser.add_argument("--measure", choices=["serving", "training"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.model, args.duration)
+        return
+
+    cpus = cpu_count()
+    config = load(args.output) or {}
+    measurements = config.get("measurements", {})
+    if args.only != "training":
+        config["serving"], measurements["serving"] = tune_serving(args, cpus)
+    if args.only != "serving":
+        config["training"], measurements["training"] = tune_training(args, cpus)
+    config.update({"cpus": cpus, "machine": platform.node(), "processor": platform.processor(),
+                   "model": args.model, "tuned": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "measurements": measurements})
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
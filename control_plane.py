@@ -0,0 +1,269 @@
+"""
+One control plane for every way of driving the robots.
+
+Gestures from the detection page and keys from the keyboard page
+(/keyboard) both end up here, tagged with the operator who sent them, and
+go through the same rules before reaching the RobotPool:
+
+- the keyboard beats gestures: while an operator holds a key, and for
+  KEYBOARD_HOLD_OFF seconds after they let go, their own gestures are
+  ignored, and so are everyone's gestures for the robots the keys were
+  sent to (when the keyboard page names robots; keys for all robots only
+  override the operator's own gestures)
+- an operator's repeated command is dropped if it comes within
+  REPEAT_INTERVAL seconds of the previous one (releases always go through)
+- every robot has its own queue and thread, so request and socket
+  handlers never wait for the robots and a robot that is slow to ack only
+  holds up its own commands; a command for several robots is queued for
+  each of them. If a robot falls behind, a command queued for it is
+  superseded by a newer one from the same operator
+
+Functions in ControlPlane.listeners are called with (command, results,
+reason) once a command has run on all its robots (a robot whose copy was
+superseded fails with error "superseded"), or with results None and the
+reason it was dropped; the detection server turns these into acks for the
+pages.
+
+Keys are sent as press/release state instead of one request per keydown:
+a press drives the robot, releasing a key falls back to the key still held
+or sends STOP_COMMAND once none is. Held keys are a lease: the page sends
+its held keys again every KEY_RENEW seconds, and if nothing arrives for
+KEY_LEASE seconds (page closed, keyup lost, Wi-Fi gone) the keys are
+released and STOP_COMMAND is sent.
+"""
+import threading
+import time
+from collections import namedtuple
+
+from robot_transport import CommandResult
+
+KEY_MAP = {"w": "forward", "a": "left", "s": "backward", "d": "right"}
+STOP_COMMAND = "stop"
+KEYBOARD_HOLD_OFF = 1.0
+REPEAT_INTERVAL = 0.15
+KEY_RENEW = 0.3  # how often the keyboard page repeats its held keys
+KEY_LEASE = 1.0  # held keys are released when not repeated for this long
+
+# tag: whatever the caller wants back in the listener calls (e.g. the page's gesture id)
+Command = namedtuple("Command", ["operator", "source", "command", "targets", "issued", "tag"],
+                     defaults=(None,))
+
+
+class OperatorState:
+    def __init__(self):
+        self.held = []  # keys in the order they were pressed
+        self.key_targets = None  # robots the held keys drive, None for all
+        self.lease_until = 0.0
+        self.keyboard_until = 0.0
+        self.last_command = None
+        self.last_sent = 0.0
+
+    def keyboard_active(self, now):
+        return bool(self.held) or now < self.keyboard_until
+
+
+class Delivery:
+    """A command on its way to its robots, reported once all of them are done."""
+
+    def __init__(self, command, robots):
+        self.command = command
+        self.robots = robots
+        self.results = {}
+
+    def done(self):
+        return len(self.results) == len(self.robots)
+
+
+class ControlPlane:
+    def __init__(self, pool, key_map=KEY_MAP, stop_command=STOP_COMMAND, key_lease=KEY_LEASE):
+        self.pool = pool
+        self.key_map = key_map
+        self.stop_command = stop_command
+        self.key_lease = key_lease
+        self.operators = {}
+        self.lock = threading.Lock()
+        self.queues = {}  # robot -> Deliveries waiting for it
+        self.robot_wakeups = {}  # robot -> Condition its thread waits on
+        self.wakeup = threading.Condition(self.lock)  # the lease thread
+        self.superseded = 0
+        self.expired = 0
+        self.listeners = []
+        threading.Thread(target=self._lease_loop, name="control-leases", daemon=True).start()
+
+    def _state(self, operator):
+        return self.operators.setdefault(operator or "", OperatorState())
+
+    def keyboard_override(self, operator, targets=None, now=None):
+        """True if keys keep this operator's gesture for targets (None: all robots) from running."""
+        now = time.monotonic() if now is None else now
+        for name, state in self.operators.items():
+            if not state.keyboard_active(now):
+                continue
+            if name == (operator or ""):
+                return True
+            if state.key_targets is not None and (targets is None or set(targets) & set(state.key_targets)):
+                return True
+        return False
+
+    def _repeat(self, state, command, now):
+        return command == state.last_command and now - state.last_sent < REPEAT_INTERVAL
+
+    def gesture(self, operator, command, targets=None, tag=None):
+        """Queue a gesture's command. Returns False if arbitration dropped it."""
+        now = time.monotonic()
+        cmd = Command(operator, "gesture", command, targets, now, tag)
+        with self.lock:
+            state = self._state(operator)
+            if self.keyboard_override(operator, targets, now):
+                reason = "keyboard override"
+            elif self._repeat(state, command, now):
+                reason = "repeat"
+            else:
+                return self._queue(state, cmd)
+        self._notify(cmd, None, reason)
+        return False
+
+    def _notify(self, command, results, reason=None):
+        for listener in self.listeners:
+            try:
+                listener(command, results, reason)
+            except Exception as e:
+                print(f"control listener failed: {e}")
+
+    def key(self, operator, key, down, tag=None, targets=None):
+        """
+        Press or release one key for targets (None: all robots). Pressing a
+        key that is already held renews the lease. Returns False if nothing
+        was sent.
+        """
+        if key not in self.key_map:
+            return False
+        now = time.monotonic()
+        targets = list(targets) if targets else None
+        with self.lock:
+            state = self._state(operator)
+            if down:
+                state.lease_until = now + self.key_lease
+                self.wakeup.notify()
+                # held keys are state: browser auto-repeat and lease renewals don't send again
+                if key in state.held:
+                    return False
+                state.held.append(key)
+                state.key_targets = targets
+                command = self.key_map[key]
+                if self._repeat(state, command, now):
+                    return False
+            else:
+                if key not in state.held:
+                    return False
+                state.held.remove(key)
+                state.keyboard_until = now + KEYBOARD_HOLD_OFF
+                command = self.key_map[state.held[-1]] if state.held else self.stop_command
+                if command is None:
+                    return False
+            return self._queue(state, Command(operator, "keyboard", command, state.key_targets, now, tag))
+
+    def release_all(self, operator):
+        """The operator's connection went away: let go of their keys."""
+        with self.lock:
+            return self._release(self.operators.get(operator or ""), operator, time.monotonic())
+
+    def _release(self, state, operator, now, tag=None):
+        # caller holds self.lock
+        if state is None or not state.held:
+            return False
+        state.held = []
+        state.keyboard_until = now + KEYBOARD_HOLD_OFF
+        if self.stop_command is None:
+            return False
+        return self._queue(state, Command(operator, "keyboard", self.stop_command, state.key_targets, now, tag))
+
+    def _expire_leases(self, now):
+        """Release the keys of operators whose page stopped renewing them. Returns seconds until the next expiry."""
+        # caller holds self.lock
+        next_expiry = None
+        for operator, state in self.operators.items():
+            if not state.held:
+                continue
+            if now >= state.lease_until:
+                print(f"keys of {operator or 'anonymous'} not renewed for {self.key_lease} s, stopping")
+                self.expired += 1
+                self._release(state, operator, now, {"reason": "lease expired"})
+            else:
+                remaining = state.lease_until - now
+                next_expiry = remaining if next_expiry is None else min(next_expiry, remaining)
+        return next_expiry
+
+    def _lease_loop(self):
+        with self.lock:
+            while True:
+                self.wakeup.wait(self._expire_leases(time.monotonic()))
+
+    def _queue(self, state, command):
+        # caller holds self.lock
+        state.last_command = command.command
+        state.last_sent = command.issued
+        robots = list(dict.fromkeys(command.targets)) if command.targets else list(self.pool.links)
+        delivery = Delivery(command, robots)
+        for robot in robots:
+            if robot not in self.pool.links:
+                delivery.results[robot] = CommandResult(robot, command.command, False, None, "unknown robot")
+                continue
+            if robot not in self.queues:
+                self.queues[robot] = []
+                self.robot_wakeups[robot] = threading.Condition(self.lock)
+                threading.Thread(target=self._robot_loop, args=(robot,), name=f"control-{robot}",
+                                 daemon=True).start()
+            self.queues[robot].append(delivery)
+            self.robot_wakeups[robot].notify()
+        if delivery.done():
+            # nothing to wait for; report from a thread, the caller holds the lock
+            threading.Thread(target=self._finish, args=(delivery,), daemon=True).start()
+        return True
+
+    def _robot_loop(self, robot):
+        wakeup = self.robot_wakeups[robot]
+        while True:
+            finished = []
+            with self.lock:
+                while not self.queues[robot]:
+                    wakeup.wait()
+                # Only the newest command of each operator reflects what they want now.
+                latest = {}
+                for delivery in self.queues[robot]:
+                    latest[delivery.command.operator or ""] = delivery
+                newest = {id(d) for d in latest.values()}
+                pending = [d for d in self.queues[robot] if id(d) in newest]
+                for old in self.queues[robot]:
+                    if id(old) not in newest:
+                        self.superseded += 1
+                        old.results[robot] = CommandResult(robot, old.command.command, False, None, "superseded")
+                        if old.done():
+                            finished.append(old)
+                self.queues[robot] = []
+            for delivery in finished:
+                self._finish(delivery)
+            for delivery in pending:
+                result = self._run(delivery.command, robot)
+                with self.lock:
+                    delivery.results[robot] = result
+                    done = delivery.done()
+                if done:
+                    self._finish(delivery)
+
+    def _finish(self, delivery):
+        results = [delivery.results[robot] for robot in delivery.robots]
+        if results and all(r.error == "superseded" for r in results):
+            self._notify(delivery.command, None, "superseded")
+        else:
+            self._notify(delivery.command, results)
+
+    def _run(self, command, robot):
+        try:
+            result, = self.pool.send(command.command, [robot])
+        except Exception as e:
+            print(f"could not send {command.command} to {robot}: {e}")
+            return CommandResult(robot, command.command, False, None, str(e) or e.__class__.__name__)
+        if not result.ok:
+            print(f"robot {robot} failed to run {result.command}: {result.error}")
+        return result
@@ -0,0 +1,223 @@
+"""
+Merge, deduplicate and summarize gesture datasets written by learning.py.
+
+    python dataset_tool.py merge gesture_data.json "gesture_data copy.json" -o merged.json
+    python dataset_tool.py merge a.json b.json -o merged.json --near-duplicates
+    python dataset_tool.py stats gesture_data.json
+
+Files are read as a stream, one recording at a time, and the output is
+written the same way, so memory only grows with the hash index (a few dozen
+bytes per recording). Exact duplicates are recordings with identical
+samples; with --near-duplicates recordings whose coarse shape (resampled to
+20 steps and quantized) matches an earlier one are dropped as well.
+"""
+import argparse
+import hashlib
+import json
+import sys
+
+import numpy as np
+
+from gesture_pipeline import AXES, resample_linear
+
+NEAR_DUP_STEPS = 20
+NEAR_DUP_QUANTUM = 0.05
+READ_CHUNK = 1 << 20
+
+
+def iter_json_array(path):
+    """Yield the objects of a top level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = f.read(READ_CHUNK).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{path} does not contain a JSON array")
+        pos = 1
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                more = f.read(READ_CHUNK)
+                if not more:
+                    raise
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield item
+            pos = end
+
+
+def sample_matrix(entry):
+    return np.array([[s[axis] for axis in AXES] for s in entry["samples"]], dtype=np.float64)
+
+
+def content_hash(entry):
+    """Hash of the recorded values (not the label), identical for exact copies."""
+    samples = sample_matrix(entry)
+    return hashlib.blake2b(samples.tobytes(), digest_size=16).digest()
+
+
+def shape_hash(entry):
+    """Hash of a coarse version of the recording, shared by near-duplicates."""
+    samples = sample_matrix(entry)
+    if len(samples) == 0:
+        return b""
+    coarse = np.round(resample_linear(samples, NEAR_DUP_STEPS) / NEAR_DUP_QUANTUM).astype(np.int32)
+    return hashlib.blake2b(coarse.tobytes(), digest_size=16).digest()
+
+
+def sample_rate(entry):
+    """Sampling rate in Hz from the per-sample timestamps, None if unknown."""
+    samples = entry["samples"]
+    if len(samples) < 2 or "timestamp" not in samples[0] or "timestamp" not in samples[-1]:
+        return None
+    duration = (samples[-1]["timestamp"] - samples[0]["timestamp"]) / 1000
+    return (len(samples) - 1) / duration if duration > 0 else None
+
+
+class DatasetSummary:
+    """
+    Per-gesture recording counts, lengths and sample rates, updated one entry
+    at a time so it never needs a rescan of the dataset.
+    """
+
+    def __init__(self):
+        self.gestures = {}
+        self.collectors = {}
+
+    def add(self, entry):
+        stats = self.gestures.setdefault(entry["gesture"], {
+            "count": 0, "samples": 0, "min_len": None, "max_len": 0,
+            "rate_n": 0, "rate_sum": 0.0, "rate_sq": 0.0, "rate_min": None, "rate_max": None})
+        length = len(entry["samples"])
+        stats["count"] += 1
+        stats["samples"] += length
+        stats["min_len"] = length if stats["min_len"] is None else min(stats["min_len"], length)
+        stats["max_len"] = max(stats["max_len"], length)
+
+        rate = sample_rate(entry)
+        if rate is not None:
+            stats["rate_n"] += 1
+            stats["rate_sum"] += rate
+            stats["rate_sq"] += rate * rate
+            stats["rate_min"] = rate if stats["rate_min"] is None else min(stats["rate_min"], rate)
+            stats["rate_max"] = rate if stats["rate_max"] is None else max(stats["rate_max"], rate)
+
+        collector = entry.get("collector")
+        if collector:
+            self.collectors[collector] = self.collectors.get(collector, 0) + 1
+
+    def as_dict(self):
+        gestures = {}
+        for gesture, g in self.gestures.items():
+            info = {"count": g["count"], "min_len": g["min_len"], "max_len": g["max_len"],
+                    "mean_len": g["samples"] / g["count"]}
+            if g["rate_n"]:
+                mean = g["rate_sum"] / g["rate_n"]
+                info["sample_rate_hz"] = {"mean": mean, "min": g["rate_min"], "max": g["rate_max"],
+                                          "std": max(g["rate_sq"] / g["rate_n"] - mean * mean, 0.0) ** 0.5}
+            gestures[gesture] = info
+        return {"total": sum(g["count"] for g in self.gestures.values()),
+                "imbalance": self.imbalance(), "gestures": gestures, "collectors": self.collectors}
+
+    def imbalance(self):
+        """Largest class count divided by the smallest one."""
+        counts = [g["count"] for g in self.gestures.values()]
+        return max(counts) / min(counts) if counts else None
+
+    def report(self):
+        lines = []
+        for gesture, g in sorted(self.gestures.items()):
+            line = (f"  {gesture:15s} {g['count']:6d} recordings, "
+                    f"length {g['min_len']}-{g['max_len']} (mean {g['samples'] / g['count']:.1f})")
+            if g["rate_n"]:
+                line += f", {g['rate_sum'] / g['rate_n']:.1f} Hz"
+            lines.append(line)
+        total = sum(g["count"] for g in self.gestures.values())
+        lines.append(f"  total {total} recordings, imbalance (largest / smallest class) "
+                     f"{self.imbalance() or 0:.2f}")
+        return "\n".join(lines)
+
+
+class DuplicateIndex:
+    def __init__(self, near_duplicates=False):
+        self.near_duplicates = near_duplicates
+        self.exact = {}  # content hash -> gesture label
+        self.shapes = set()
+        self.duplicates = 0
+        self.near = 0
+        self.conflicts = 0  # same recording saved under different gestures
+
+    def seen(self, entry):
+        """Register entry, returns True if it duplicates an earlier one."""
+        key = content_hash(entry)
+        label = self.exact.get(key)
+        if label is not None:
+            self.duplicates += 1
+            self.conflicts += label != entry["gesture"]
+            return True
+        self.exact[key] = entry["gesture"]
+        if self.near_duplicates:
+            shape = shape_hash(entry)
+            if shape in self.shapes:
+                self.near += 1
+                return True
+            self.shapes.add(shape)
+        return False
+
+
+def deduplicate(entries, near_duplicates=False):
+    """Returns the entries without duplicates, first occurrence wins."""
+    index = DuplicateIndex(near_duplicates)
+    return [entry for entry in entries if not index.seen(entry)]
+
+
+def merge(inputs, output, near_duplicates=False):
+    index = DuplicateIndex(near_duplicates)
+    summary = DatasetSummary()
+    with open(output, "w", encoding="utf-8") as out:
+        out.write("[\n")
+        first = True
+        for path in inputs:
+            for entry in iter_json_array(path):
+                if index.seen(entry):
+                    continue
+                summary.add(entry)
+                out.write(("" if first else ",\n") + json.dumps(entry))
+                first = False
+        out.write("\n]\n")
+    return index, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge and inspect gesture datasets.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    merge_cmd = commands.add_parser("merge", help="merge datasets, dropping duplicates")
+    merge_cmd.add_argument("inputs", nargs="+")
+    merge_cmd.add_argument("-o", "--output", required=True)
+    merge_cmd.add_argument("--near-duplicates", action="store_true", help="also drop near-duplicate recordings")
+    stats_cmd = commands.add_parser("stats", help="per-gesture counts and duplicates")
+    stats_cmd.add_argument("inputs", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        if args.output in args.inputs:
+            sys.exit("output file must not be one of the inputs")
+        index, summary = merge(args.inputs, args.output, args.near_duplicates)
+        print(f"Merged {len(args.inputs)} file(s) into {args.output}")
+    else:
+        index, summary = DuplicateIndex(near_duplicates=True), DatasetSummary()
+        for path in args.inputs:
+            for entry in iter_json_array(path):
+                if not index.seen(entry):
+                    summary.add(entry)
+    print(summary.report())
+    print(f"  dropped {index.duplicates} exact duplicates ({index.conflicts} with conflicting labels), "
+          f"{index.near} near-duplicates")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,37 @@
-from flask import Flask, request, jsonify, render_template_string
+# Thread pool sizes from autotune.py, before numpy/TensorFlow create their pools
+import thread_config
+thread_config.apply("serving")
+
+from flask import Flask, request, jsonify, Response, stream_with_context
 import numpy as np
-from tensorflow.keras.models import load_model
 import pickle
 import logging
+import os
+import json
+import hmac
+import math
+import re
+import time
+import threading
+import uuid
+
+from robot_transport import RobotPool, parse_robot_urls
+from session_recorder import start_session, append_records, log_event, SessionFull, MAX_APPEND_BYTES
+from profiling import RequestProfiler
+from personalization import Head, HeadCache, embedding_model
+from control_plane import ControlPlane, KEY_RENEW
+from feedback import FeedbackHub, sse_stream, pump
+from audit_log import AuditLog, AUDIT_FILE
+from features import FEATURES_MODEL_FILE
+from embedding_index import EmbeddingIndex, IndexFile, INDEX_FILE
+from gesture_pipeline import AXES, WINDOW_LENGTH, resample_linear
+from admission import AdmissionController, Shed
+from static_assets import StaticAssets
+
+try:
+    from flask_sock import Sock  # persistent /control connections, optional
+except ImportError:
+    Sock = None
 
 
 # zeroconf = Zeroconf()
@@ -22,17 +51,48 @@ import logging
 # zeroconf.register_service(info)
 
 app = Flask(__name__)
+# /admin/profile is only enabled when ADMIN_TOKEN is set, see profiling.py
+profiler = RequestProfiler(app, token=os.environ.get("ADMIN_TOKEN"))
 
-# Load trained model and label encoder
-MODEL_FILE = "gesture_model.h5"
+# Load trained model and label encoder. GESTURE_BACKEND=features uses the
+# scikit-learn model from features.py instead, without importing TensorFlow.
+BACKEND = os.environ.get("GESTURE_BACKEND", "keras")
+MODEL_FILE = os.environ.get("GESTURE_MODEL_FILE", FEATURES_MODEL_FILE if BACKEND == "features" else "gesture_model.h5")
 LE_FILE = "label_encoder.pkl"
 
 print("Loading model...")
-model = load_model(MODEL_FILE)
+if BACKEND == "features":
+    with open(MODEL_FILE, "rb") as f:
+        model = pickle.load(f)
+else:
+    from tensorflow.keras.models import load_model
+    model = load_model(MODEL_FILE)
 with open(LE_FILE, "rb") as f:
     label_encoder = pickle.load(f)
 print("Model and label encoder loaded.")
 
+# Per-operator output heads on the shared backbone (see personalization.py),
+# loaded on demand and kept in an LRU cache of at most HEAD_CACHE_MB.
+if BACKEND == "features":
+    embedder = head_cache = None  # heads need the Keras model's hidden layers
+else:
+    embedder = embedding_model(model)
+    head_cache = HeadCache(int(os.environ.get("HEAD_CACHE_MB", "64")) * 1024 * 1024,
+                           kernel_shape=model.layers[-1].get_weights()[0].shape)
+
+# Few-shot gestures: labelled recordings sent to /index/add are recognized by
+# nearest-neighbour lookup on the same embedding, see embedding_index.py.
+if embedder is not None:
+    base_head = Head(*model.layers[-1].get_weights())  # the model's own output layer
+    embedding_index = EmbeddingIndex(embedder.output_shape[-1])
+    index_file = IndexFile(os.environ.get("INDEX_FILE", INDEX_FILE))
+else:
+    base_head = embedding_index = index_file = None
+INDEX_TOKEN = os.environ.get("INDEX_TOKEN")  # without it /index/add only accepts local requests
+LOOPBACK = {"127.0.0.1", "::1"}
+MODEL_LABELS = set(label_encoder.classes_)
+_NAME = re.compile(r"^[0-9a-zA-Z_.-]{1,64}$")  # gesture and command names, commands go out as text lines
+
 HTML_PAGE = """
 <!DOCTYPE html>
 <html>
@@ -128,9 +188,12 @@ HTML_PAGE = """
     <h1>Live Gesture Recognition</h1>
     <p>Enable motion sensors and move your device!</p>
     <button id="enableSensorsBtn">Enable Motion Sensors</button>
+    <button id="sessionBtn">Record Session</button>
     <p id="status"></p>
     <p>Predicted Gesture:</p>
     <span id="gestureDisplay">None</span>
+    <p id="feedback"></p>
+    <p id="robots"></p>
     </div>
 
 <script>
@@ -150,6 +213,11 @@ const QUIET_FRAMES_LIMIT = 20;  // How many frames of stillness before concludin
 const status = document.getElementById("status");
 const display = document.getElementById("gestureDisplay");
 const enableBtn = document.getElementById("enableSensorsBtn");
+const sessionBtn = document.getElementById("sessionBtn");
+
+// Operator name for personalized models: open the page once with ?operator=name
+const operator = new URLSearchParams(location.search).get("operator") || localStorage.getItem("operator");
+if (operator) localStorage.setItem("operator", operator);
 
 // iOS motion permission
 enableBtn.addEventListener("click", async () => {
@@ -247,37 +315,214 @@ function sendBufferForPrediction(){
     let processed = cropRecording(buffer);
     processed = resample(processed, 100);
 
-    fetch("/predict", {
-        method:"POST",
-        headers:{"Content-Type":"application/json"},
-        body:JSON.stringify({samples:processed})
-    })
-    .then(res=>res.json())
-    .then(res=>{ 
-        const gesture = res.predicted_gesture;
-        display.textContent = gesture; 
+    // The server asked us to back off: drop the gesture rather than send it late
+    if (Date.now() < backoffUntil) {
+        buffer = [];
+        return;
+    }
+
+    const id = nextGestureId++;
+    sentAt[id] = performance.now();
+    const body = {samples:processed, operator:operator, session:sessionId, t:lastSampleTime, client:clientId, id:id,
+                  sent_at:Date.now()};
+    if (controlReady) {
+        controlSocket.send(JSON.stringify(Object.assign({type:"predict"}, body)));
+    } else {
+        fetch("/predict", {
+            method:"POST",
+            headers:{"Content-Type":"application/json"},
+            body:JSON.stringify(body)
+        })
+        .then(res=>res.json())
+        .then(showPrediction)
+        .catch(err=>{ console.error(err); });
+    }
+    
+    buffer = [];
+}
+
+let backoffUntil = 0;
+
+function showPrediction(res) {
+    if (res.shed) {
+        delete sentAt[res.id];
+        backoffUntil = Date.now() + 1000 * (res.retry_after || 0);
+        feedbackEl.textContent = "Server busy, gesture dropped (" + res.shed + ")";
+        return;
+    }
+    if (res.error) {
+        delete sentAt[res.id];
+        feedbackEl.textContent = "Gesture rejected: " + res.error;
+        return;
+    }
+    const gesture = res.predicted_gesture;
+    display.textContent = gesture; 
+    
+    // Pause and show big text if it's a real gesture
+    if (gesture && gesture.toLowerCase() !== "noise" && gesture !== "No data") {
+        isPaused = true; 
+        display.classList.add("big-text");
         
-        // Pause and show big text if it's a real gesture
-        if (gesture && gesture.toLowerCase() !== "noise" && gesture !== "No data") {
-            isPaused = true; 
-            display.classList.add("big-text");
-            
-            setTimeout(() => {
-                display.classList.remove("big-text");
-                display.textContent = "None";
-                buffer = []; 
-                isPaused = false; 
-            }, 500);
+        setTimeout(() => {
+            display.classList.remove("big-text");
+            display.textContent = "None";
+            buffer = []; 
+            isPaused = false; 
+        }, 500);
+    }
+}
+
+// --- Robot feedback: acks with latency and robot status, pushed by the server ---
+const feedbackEl = document.getElementById("feedback");
+const robotsEl = document.getElementById("robots");
+const clientId = Math.random().toString(36).slice(2);
+let nextGestureId = 1;
+let sentAt = {};  // gesture id -> performance.now() when it was sent
+let events = null;
+
+function showAck(ack) {
+    let e2e = null;
+    if (ack.id in sentAt) {
+        e2e = performance.now() - sentAt[ack.id];
+        delete sentAt[ack.id];
+    }
+    if (ack.dropped) {
+        feedbackEl.textContent = ack.command + ": ignored (" + ack.dropped + ")";
+    } else if (ack.ok) {
+        const robotMs = Math.max(...ack.robots.map(r => r.latency_ms));
+        feedbackEl.textContent = ack.command + " ✅ robot " + robotMs.toFixed(0) + " ms" +
+            (e2e !== null ? ", end-to-end " + e2e.toFixed(0) + " ms" : "");
+    } else {
+        const failed = ack.robots.filter(r => !r.ok).map(r => r.robot + ": " + r.error);
+        feedbackEl.textContent = ack.command + " ❌ " + (failed.join(", ") || "no robots");
+    }
+}
+
+function showStatus(robots) {
+    robotsEl.textContent = robots.map(r => r.robot + (r.connected ? " 🟢" : " 🔴") +
+        (r.last_latency_ms !== null ? " " + r.last_latency_ms.toFixed(0) + " ms" : "")).join("   ");
+}
+
+function handleFeedback(kind, data) {
+    if (kind === "ack") showAck(data);
+    else if (kind === "status") showStatus(data);
+}
+
+const STREAM_RETRY_MS = __STREAM_RETRY_MS__;  // server busy: how long before trying a stream again
+
+// Only used when there is no /control socket to carry the feedback
+function startEvents() {
+    if (events || typeof EventSource === "undefined") return;
+    events = new EventSource("/events?client=" + clientId);
+    events.addEventListener("ack", e => handleFeedback("ack", JSON.parse(e.data)));
+    events.addEventListener("status", e => handleFeedback("status", JSON.parse(e.data)));
+    events.onerror = () => {
+        // refused (server busy): EventSource gives up, try again later
+        if (events.readyState !== EventSource.CLOSED) return;
+        events = null;
+        setTimeout(startEvents, STREAM_RETRY_MS);
+    };
+}
+
+// --- Persistent /control connection, predictions fall back to POST /predict without it ---
+const controlPassword = new URLSearchParams(location.search).get("password") || localStorage.getItem("controlPassword");
+if (controlPassword) localStorage.setItem("controlPassword", controlPassword);
+let controlSocket = null;
+let controlReady = false;
+
+function connectControl() {
+    if (typeof WebSocket === "undefined") { startEvents(); return; }
+    const socket = new WebSocket((location.protocol === "https:" ? "wss://" : "ws://") + location.host + "/control");
+    let opened = false;
+    let busy = false;
+    controlSocket = socket;
+    socket.onopen = () => {
+        opened = true;
+        socket.send(JSON.stringify({type:"hello", operator:operator, password:controlPassword, client:clientId}));
+    };
+    socket.onmessage = (e) => {
+        const msg = JSON.parse(e.data);
+        if (msg.type === "ready") controlReady = true;
+        else if (msg.type === "prediction") showPrediction(msg);
+        else if (msg.type === "error") {  // e.g. wrong password, stay on HTTP
+            opened = false;
+            busy = msg.error === "busy";
+        }
+        else handleFeedback(msg.type, msg.data);
+    };
+    socket.onclose = () => {
+        controlReady = false;
+        if (opened) setTimeout(connectControl, 1000);
+        else if (busy) setTimeout(connectControl, STREAM_RETRY_MS);  // predictions go over POST meanwhile
+        else startEvents();
+    };
+}
+connectControl();
+
+// --- Session recording: raw devicemotion stream, packed as in session_recorder.py ---
+const RECORD_SIZE = 32; // float64 timestamp + 6x float32
+const MAX_APPEND_BYTES = 256 * 1024; // session_recorder.MAX_APPEND_BYTES
+let sessionId = null;
+let sessionChunks = [];
+let sessionTimer = null;
+let lastSampleTime = null;
+
+sessionBtn.addEventListener("click", async () => {
+    if (sessionId) {
+        const id = sessionId;
+        sessionId = null;
+        clearInterval(sessionTimer);
+        while (sessionChunks.length > 0) flushSession(id);
+        sessionBtn.textContent = "Record Session";
+        return;
+    }
+    try {
+        const res = await fetch("/session", {
+            method:"POST",
+            headers:{"Content-Type":"application/json"},
+            body:JSON.stringify({user_agent:navigator.userAgent, android:/Android/i.test(navigator.userAgent)})
+        });
+        const reply = await res.json();
+        if (!res.ok) {
+            status.textContent = "Could not start session recording: " + reply.error;
+            return;
         }
+        sessionId = reply.session;
+        sessionTimer = setInterval(()=>flushSession(sessionId), 1000);
+        sessionBtn.textContent = "Stop Recording Session";
+    } catch (err) {
+        console.error(err);
+        status.textContent = "Could not start session recording";
+    }
+});
+
+function recordRawSample(timestamp, s) {
+    const view = new DataView(new ArrayBuffer(RECORD_SIZE));
+    view.setFloat64(0, timestamp, true);
+    [s.x, s.y, s.z, s.alpha, s.beta, s.gamma].forEach((v, i) => view.setFloat32(8 + 4*i, v, true));
+    sessionChunks.push(view.buffer);
+}
+
+function flushSession(id) {
+    if (!id || sessionChunks.length === 0) return;
+    // after an outage the backlog goes out in pieces the server accepts, one per second
+    const sent = sessionChunks.splice(0, MAX_APPEND_BYTES / RECORD_SIZE);
+    fetch(`/session/${id}`, {method:"POST", headers:{"Content-Type":"application/octet-stream"}, body:new Blob(sent)})
+    .then(async res=>{
+        if (res.status !== 413 || sessionId !== id) return;
+        // the session or the server's session storage is full
+        sessionId = null;
+        clearInterval(sessionTimer);
+        sessionChunks = [];
+        sessionBtn.textContent = "Record Session";
+        status.textContent = "Session recording stopped: " + (await res.json()).error;
     })
-    .catch(err=>{ console.error(err); });
-    
-    buffer = [];
+    .catch(err=>{ console.error(err); sessionChunks.unshift(...sent); });
 }
 
 window.addEventListener("devicemotion", (event)=>{
-    if(!permissionGranted || isPaused) return; 
-    
+    if(!permissionGranted) return;
+
     let sample = {
         x: event.acceleration.x || 0,
         y: event.acceleration.y || 0,
@@ -286,6 +531,10 @@ window.addEventListener("devicemotion", (event)=>{
         beta: event.rotationRate.beta || 0,
         gamma: event.rotationRate.gamma || 0
     };
+    lastSampleTime = performance.timeOrigin + event.timeStamp;
+    if (sessionId) recordRawSample(lastSampleTime, sample);
+    if (isPaused) return;
+
     sample = correctAxes(sample);
     sample = normalizeSample(sample);
     sample = smoothSample(sample);
@@ -335,40 +584,531 @@ window.addEventListener("devicemotion", (event)=>{
 </html>
 """
 
-COMMAND_MAP =  {"flick_front": None,
-                "flick_right": None,
-                "flick_left": None,
-                "flick_back": None,
+# WASD controller (ported from junk/server.py): keys are sent as press/release
+# state over one /control connection instead of a POST per keydown.
+KEYBOARD_PAGE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>WASD Controller</title>
+    <style>
+        body { font-family: Arial; text-align: center; margin-top: 40px; }
+        .key { font-size: 40px; padding: 20px; margin: 10px; display: inline-block; border: 2px solid #333; width: 80px; }
+        .key.held { background-color: #333; color: #fff; }
+        input, button { font-size: 18px; margin: 4px; }
+    </style>
+</head>
+<body>
+    <h1>WASD Control Panel</h1>
+    <div id="login">
+        <input id="operator" placeholder="Operator name" />
+        <input id="password" type="password" placeholder="Password" />
+        <input id="robots" placeholder="Robots (all)" />
+        <button id="connectBtn">Connect</button>
+    </div>
+    <p id="status">Not connected</p>
+    <p>Use your keyboard (W A S D)</p>
+    <div>
+        <div class="key" id="key-w">W</div><br>
+        <div class="key" id="key-a">A</div>
+        <div class="key" id="key-s">S</div>
+        <div class="key" id="key-d">D</div>
+    </div>
+
+<script>
+const KEYS = ["w","a","s","d"];
+const status = document.getElementById("status");
+const operatorInput = document.getElementById("operator");
+const passwordInput = document.getElementById("password");
+const robotsInput = document.getElementById("robots");
+operatorInput.value = localStorage.getItem("operator") || "";
+robotsInput.value = localStorage.getItem("robots") || "";
+// Held keys are a lease on the server: repeat them well within KEY_LEASE
+const KEY_RENEW_MS = __KEY_RENEW_MS__;
+
+const clientId = Math.random().toString(36).slice(2);
+let ws = null;
+let ready = false;
+let useHttp = false;  // server without flask-sock: POST key events to /control/input
+let active = false;
+const held = new Set();
+
+function credentials() {
+    return {operator: operatorInput.value, password: passwordInput.value, client: clientId};
+}
+
+function showAck(ack) {
+    if (ack.dropped) return;
+    const robotMs = ack.robots.length ? Math.max(...ack.robots.map(r => r.latency_ms || 0)) : 0;
+    status.textContent = ack.command + (ack.ok ? " ✔ " + robotMs.toFixed(0) + " ms" : " ✘ " +
+        (ack.robots.filter(r => !r.ok).map(r => r.robot + ": " + r.error).join(", ") || "no robots"));
+}
+
+function connect() {
+    const socket = new WebSocket((location.protocol === "https:" ? "wss://" : "ws://") + location.host + "/control");
+    let opened = false;
+    ws = socket;
+    socket.onopen = () => {
+        opened = true;
+        socket.send(JSON.stringify(Object.assign({type:"hello"}, credentials())));
+    };
+    socket.onmessage = (e) => {
+        const msg = JSON.parse(e.data);
+        if (msg.type === "ready") {
+            ready = true;
+            status.textContent = "Connected as " + (msg.operator || "anonymous");
+        } else if (msg.type === "error" && msg.error === "busy") {
+            // no stream thread free: keys still work over HTTP, without acks
+            active = false;
+            useHttp = true;
+            status.textContent = "Server busy, sending keys over HTTP";
+        } else if (msg.type === "error") {
+            active = false;
+            status.textContent = "Error: " + msg.error;
+        } else if (msg.type === "ack") {
+            showAck(msg.data);
+        }
+    };
+    socket.onclose = () => {
+        ready = false;
+        releaseAll(false);
+        if (!opened && !useHttp) {
+            useHttp = true;
+            status.textContent = "Connected over HTTP";
+            return;
+        }
+        if (active) {
+            status.textContent = "Reconnecting...";
+            setTimeout(connect, 1000);
+        }
+    };
+}
+
+function keyMessage(key, down) {
+    const robots = robotsInput.value.split(",").map(r => r.trim()).filter(r => r);
+    return {type:"key", key:key, down:down, robots:robots.length ? robots : null};
+}
+
+function sendEvents(events) {
+    if (ready) {
+        events.forEach(msg => ws.send(JSON.stringify(msg)));
+    } else if (useHttp) {
+        fetch("/control/input", {
+            method: "POST",
+            headers: {"Content-Type": "application/json"},
+            body: JSON.stringify(Object.assign({events:events}, credentials()))
+        }).then(res => { if (res.status === 403) status.textContent = "Wrong password"; })
+        .catch(err => console.error(err));
+    }
+}
+
+function sendKey(key, down) {
+    sendEvents([keyMessage(key, down)]);
+}
+
+setInterval(() => {
+    if (held.size) sendEvents([...held].map(key => keyMessage(key, true)));
+}, KEY_RENEW_MS);
+
+function setHeld(key, down) {
+    document.getElementById("key-" + key).classList.toggle("held", down);
+}
+
+function releaseAll(send) {
+    held.forEach(key => { setHeld(key, false); if (send) sendKey(key, false); });
+    held.clear();
+}
+
+document.getElementById("connectBtn").addEventListener("click", () => {
+    localStorage.setItem("operator", operatorInput.value);
+    localStorage.setItem("robots", robotsInput.value);
+    active = true;
+    if (ws) ws.close();
+    connect();
+});
+
+document.addEventListener("keydown", function(e) {
+    const key = e.key.toLowerCase();
+    if (!KEYS.includes(key) || e.repeat || held.has(key) || document.activeElement.tagName === "INPUT") return;
+    held.add(key);
+    setHeld(key, true);
+    sendKey(key, true);
+});
+
+document.addEventListener("keyup", function(e) {
+    const key = e.key.toLowerCase();
+    if (!held.has(key)) return;
+    held.delete(key);
+    setHeld(key, false);
+    sendKey(key, false);
+});
+
+// Keys released while the window has no focus never fire keyup
+window.addEventListener("blur", () => releaseAll(true));
+</script>
+
+</body>
+</html>
+"""
+
+# Robots to drive, name -> transport URL (see robot_transport.py), e.g.
+# ROBOT_URLS="rover=tcp://192.168.1.50:9000,arm=udp://192.168.1.51:9001"
+ROBOTS = parse_robot_urls(os.environ.get("ROBOT_URLS", ""))
+
+COMMAND_MAP =  {"flick_front": "forward",
+                "flick_right": "right",
+                "flick_left": "left",
+                "flick_back": "backward",
                 "noise": None}
-def send_robot_command(gesture: str):
-    if not COMMAND_MAP[gesture]:
-        print("no known command for gesture: " + gesture)
-        return
-    COMMAND_MAP[gesture]()
+# gesture -> robot names; gestures not listed here go to every robot
+COMMAND_TARGETS = {}
+
+robot_pool = RobotPool(ROBOTS)
+robot_pool.connect()
+# Gestures and the keyboard page drive the robots through one control plane
+# (keyboard overrides gestures, repeats are rate limited), see control_plane.py
+control = ControlPlane(robot_pool)
 
+# Required in the first message on /control (and by /control/input) if set
+CONTROL_PASSWORD = os.environ.get("CONTROL_PASSWORD")
+
+# Acks and robot status pushed to the pages (/events or their /control socket), see feedback.py
+# Every open /events stream and /control socket holds a server thread, so
+# they may only take what is left after STREAM_RESERVED_THREADS for
+# /predict and the other short requests. serve.py passes its --threads as
+# GESTURE_THREADS; Flask's development server has a thread per connection.
+STREAM_RESERVED_THREADS = 4
+SERVER_THREADS = int(os.environ.get("GESTURE_THREADS", "0"))
+MAX_STREAMS = int(os.environ.get("MAX_STREAMS") or
+                  (max(SERVER_THREADS - STREAM_RESERVED_THREADS, 1) if SERVER_THREADS else 64))
+STREAM_RETRY_SECONDS = 30
+
+feedback = FeedbackHub(MAX_STREAMS)
+feedback.poll("status", robot_pool.status)
+
+def publish_ack(command, results, reason):
+    """ControlPlane listener: tell the page that sent the command what became of it."""
+    tag = command.tag or {}
+    ack = {"id": tag.get("id"), "command": command.command, "source": command.source}
+    if results is None:
+        ack.update(ok=False, dropped=reason)
+    else:
+        ack.update(ok=bool(results) and all(r.ok for r in results),
+                   robots=[r._asdict() for r in results],
+                   server_ms=(time.monotonic() - tag.get("received", command.issued)) * 1000)
+    feedback.publish("ack", ack, tag.get("client"))
+    if results:
+        feedback.publish("status", robot_pool.status())
+
+control.listeners.append(publish_ack)
+
+# Every prediction goes to a JSON lines log written in the background, see audit_log.py.
+# AUDIT_HASH_WINDOWS=1 also records a hash of each input window.
+audit = AuditLog(os.environ.get("AUDIT_LOG", AUDIT_FILE),
+                 hash_windows=os.environ.get("AUDIT_HASH_WINDOWS") == "1")
+
+def send_robot_command(gesture: str, operator=None, tag=None):
+    if not COMMAND_MAP.get(gesture):
+        audit.log({"event": "unmapped", "label": gesture, "operator": operator})
+        return False
+    return control.gesture(operator, COMMAND_MAP[gesture], COMMAND_TARGETS.get(gesture), tag)
+
+def control_authorized(password):
+    if not CONTROL_PASSWORD:
+        return True
+    return isinstance(password, str) and hmac.compare_digest(password.encode(), CONTROL_PASSWORD.encode())
+
+
+# Pages and client-side model files are rendered and compressed once, served
+# with cache headers and kept on the phone by a service worker, see
+# static_assets.py. Put tf.min.js in static/ to serve TF.js without a CDN.
+# The pages classify on the server, so the model files are only precached
+# on the phones with PRECACHE_MODEL=1.
+PRECACHE_MODEL = os.environ.get("PRECACHE_MODEL") == "1"
+assets = StaticAssets(app, "detection")
+assets.add_file(os.path.join("static", "tf.min.js"), precache=PRECACHE_MODEL)
+assets.add_dir(os.environ.get("TFJS_MODEL_DIR", "tfjs_model"), precache=PRECACHE_MODEL)
+assets.add_page("/", HTML_PAGE.replace("__STREAM_RETRY_MS__", str(STREAM_RETRY_SECONDS * 1000)))
+assets.add_page("/keyboard", KEYBOARD_PAGE.replace("__KEY_RENEW_MS__", str(int(KEY_RENEW * 1000))))
+assets.install()
 
 @app.route("/")
 def index():
-    return render_template_string(HTML_PAGE)
+    return assets.page("/")
 
-@app.route("/predict", methods=["POST"])
-def predict():
-    content = request.get_json()
-    samples = content.get("samples")
-    if not samples:
-        return jsonify({"predicted_gesture":"No data"}), 400
+def refresh_index():
+    """Embed recordings appended to the index file since the last call, by any worker."""
+    if index_file is None:
+        return
+    records = index_file.read_new()
+    if not records:
+        return
+    windows = np.array([r["window"] for r in records], dtype=np.float32).reshape(len(records), -1)
+    embedding_index.add(embedder.predict(windows, batch_size=256, verbose=0), [r["gesture"] for r in records])
+    for r in records:
+        # the index only defines new gestures, trained ones keep their command
+        if r.get("command") and r["gesture"] not in MODEL_LABELS:
+            COMMAND_MAP[r["gesture"]] = r["command"]
 
+refresh_index()
+
+def classify(window, operator=None):
+    """
+    window: (100, 6) array of preprocessed samples.
+    Returns (label, probabilities), using the operator's own head if they have
+    one. Gestures the model doesn't know come from the embedding index.
+    """
     # Flatten 100 samples x 6 features -> 600-dim vector
-    X = np.array([[s["x"],s["y"],s["z"],s["alpha"],s["beta"],s["gamma"]] for s in samples]).flatten()[np.newaxis,:]
-    
-    # Predict
-    pred_probs = model.predict(X, verbose=0)
+    X = np.asarray(window, dtype=np.float32).reshape(1, -1)
+    refresh_index()
+    head = head_cache.get(operator) if operator and head_cache else None
+    use_index = embedding_index is not None and embedding_index.size > 0
+    if head is not None or use_index:
+        embedding = embedder(X, training=False).numpy()
+        pred_probs = (head or base_head)(embedding)[0]
+    elif BACKEND == "features":
+        pred_probs = model.predict(X, verbose=0)[0]
+    else:
+        # a direct call: for one window model.predict() costs far more than the model itself
+        pred_probs = model(X, training=False).numpy()[0]
     pred_label = label_encoder.inverse_transform([np.argmax(pred_probs)])[0]
-    print(pred_label)
+    if use_index:
+        index_label, _, _ = embedding_index.classify(embedding[0])
+        if index_label is not None and index_label not in MODEL_LABELS:
+            pred_label = index_label
+    return pred_label, pred_probs
+
+@app.route("/index/add", methods=["POST"])
+def index_add():
+    """
+    Labelled recordings for the embedding index, as saved by learning.py:
+    {"recordings": [{"gesture": ..., "samples": [...], "command": ...}, ...]}
+    Samples are the preprocessed ones, any length; command (optional) is
+    what the gesture sends to the robots, only for gestures the model wasn't
+    trained on. Needs INDEX_TOKEN in X-Index-Token, or a request from this
+    machine when no INDEX_TOKEN is set.
+    """
+    if embedding_index is None:
+        return jsonify({"error": "the embedding index needs the keras backend"}), 404
+    if INDEX_TOKEN:
+        if not hmac.compare_digest(request.headers.get("X-Index-Token", "").encode(), INDEX_TOKEN.encode()):
+            return jsonify({"error": "unauthorized"}), 403
+    elif request.remote_addr not in LOOPBACK:
+        return jsonify({"error": "set INDEX_TOKEN to add recordings from other machines"}), 403
+    content = request.get_json(silent=True) or {}
+    records = []
+    try:
+        for rec in content.get("recordings", []):
+            samples = rec.get("samples") or []
+            command = rec.get("command") or None
+            if not _NAME.match(str(rec.get("gesture", ""))) or (command and not _NAME.match(str(command))):
+                raise ValueError("gesture and command names may only contain letters, digits, _ . -")
+            if command and rec["gesture"] in MODEL_LABELS:
+                raise ValueError(f"{rec['gesture']} is a trained gesture, its command can't be changed here")
+            if len(samples) < 2:
+                continue
+            values = np.array([[float(s[axis]) for axis in AXES] for s in samples])
+            window = resample_linear(values, WINDOW_LENGTH).astype(np.float32)
+            records.append({"gesture": rec["gesture"], "window": window.reshape(-1).tolist(), "command": command})
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if records:
+        index_file.append(records)
+        refresh_index()
+    return jsonify({"added": len(records), "size": embedding_index.size})
+
+@app.route("/index")
+def index_stats():
+    if embedding_index is None:
+        return jsonify({"error": "the embedding index needs the keras backend"}), 404
+    refresh_index()
+    return jsonify({"size": embedding_index.size, "gestures": embedding_index.counts(),
+                    "commands": {g: c for g, c in COMMAND_MAP.items() if c}})
+
+# Bounded concurrency, per device rate limits and deadlines for predictions, see admission.py
+admission = AdmissionController(max_in_flight=int(os.environ.get("PREDICT_MAX_IN_FLIGHT", "2")),
+                                max_queue=int(os.environ.get("PREDICT_MAX_QUEUE", "8")),
+                                max_age_ms=float(os.environ.get("PREDICT_MAX_AGE_MS", "500")),
+                                rate=float(os.environ.get("PREDICT_RATE", "5")))
+
+def handle_prediction(content, operator=None, client=None):
+    """
+    Classify one gesture from the page, drive the robots and log it. Returns
+    the label, raises Shed if admission control turned the request away and
+    ValueError if the samples are malformed.
+    """
+    # the ack for this gesture goes back to the page that sent it, with its id
+    client = client or content.get("client")
+    tag = {"client": client, "id": content.get("id"), "received": time.monotonic()}
+    try:
+        window = np.array([[s["x"],s["y"],s["z"],s["alpha"],s["beta"],s["gamma"]] for s in content["samples"]],
+                          dtype=np.float32)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"malformed samples: {e!r}") from None
+    operator = operator or content.get("operator")
+    # rate limited by address, the page's client id is whatever the page says it is
+    with admission.slot(request.remote_addr, content.get("sent_at")) as ticket:
+        start = time.perf_counter()
+        pred_label, pred_probs = classify(window, operator)
+    audit.log({"event": "prediction", "label": pred_label,
+               "probs": dict(zip(label_encoder.classes_.tolist(), pred_probs.tolist())),
+               "latency_ms": (time.perf_counter() - start) * 1000, "operator": operator,
+               "device": request.headers.get("User-Agent"), "remote": request.remote_addr,
+               "session": content.get("session")}, window)
     if pred_label != "noise":
-        send_robot_command(pred_label)
+        if ticket.expired(admission.max_age_ms):
+            # too late to be what the operator meant now, don't move the robots
+            admission.late()
+            feedback.publish("ack", {"id": tag["id"], "command": COMMAND_MAP.get(pred_label), "source": "gesture",
+                                     "ok": False, "dropped": "late"}, client)
+        else:
+            send_robot_command(pred_label, operator, tag)
+
+    if content.get("session"):
+        try:
+            log_event(content["session"], {"t": content.get("t"), "label": pred_label})
+        except (ValueError, OSError) as e:
+            print(f"could not log session event: {e}")
+    return pred_label
+
+@app.route("/predict", methods=["POST"])
+def predict():
+    content = request.get_json(silent=True)
+    if not isinstance(content, dict) or not content.get("samples"):
+        return jsonify({"predicted_gesture":"No data"}), 400
+    try:
+        return jsonify({"predicted_gesture": handle_prediction(content), "id": content.get("id")})
+    except ValueError as e:
+        return jsonify({"predicted_gesture": None, "error": str(e), "id": content.get("id")}), 400
+    except Shed as e:
+        response = jsonify(shed_reply(e, content.get("id")))
+        response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+        return response, e.status
+
+def shed_reply(e, gesture_id):
+    return {"predicted_gesture": None, "shed": e.reason, "retry_after": e.retry_after, "id": gesture_id}
+
+@app.route("/metrics")
+def metrics():
+    return jsonify({"admission": admission.metrics(), "audit": audit.stats(), "feedback": feedback.stats(),
+                    "control": {"superseded": control.superseded, "expired_keys": control.expired}})
+
+@app.route("/events")
+def events():
+    """Server-Sent Events with the acks for ?client= and robot status."""
+    sub = feedback.subscribe(request.args.get("client"))
+    if sub is None:
+        return jsonify({"error": "busy"}), 503, {"Retry-After": str(STREAM_RETRY_SECONDS)}
+    return Response(stream_with_context(sse_stream(feedback, sub)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/keyboard")
+def keyboard():
+    return assets.page("/keyboard")
+
+def control_message(operator, message, client=None):
+    """One message from the control connection, returns the reply or None."""
+    kind = message.get("type")
+    if kind == "key":
+        robots = message.get("robots")
+        robots = [str(r) for r in robots] if isinstance(robots, list) else None
+        control.key(operator, str(message.get("key", "")).lower(), bool(message.get("down")),
+                    {"client": client, "id": message.get("id")}, robots)
+    elif kind == "predict":
+        if not message.get("samples"):
+            return {"type": "prediction", "predicted_gesture": "No data", "id": message.get("id")}
+        try:
+            return {"type": "prediction", "predicted_gesture": handle_prediction(message, operator, client),
+                    "id": message.get("id")}
+        except ValueError as e:
+            # what /predict answers with a 400, the socket stays open
+            return {"type": "prediction", "predicted_gesture": None, "error": str(e), "id": message.get("id")}
+        except Shed as e:
+            return dict(shed_reply(e, message.get("id")), type="prediction")
+    return None
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route("/control")
+    def control_socket(ws):
+        """
+        One persistent connection per operator. The first message is
+        {"type": "hello", "operator": ..., "password": ..., "client": ...},
+        then key press/release and predict messages as handled by
+        control_message(). Feedback comes back as {"type": kind, "data": ...}.
+        """
+        try:
+            hello = json.loads(ws.receive(timeout=10) or "{}")
+        except ValueError:
+            hello = {}
+        if hello.get("type") != "hello" or not control_authorized(hello.get("password")):
+            ws.send(json.dumps({"type": "error", "error": "unauthorized"}))
+            return
+        operator = str(hello.get("operator") or "")
+        client = str(hello.get("client") or uuid.uuid4().hex)
+        send_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                ws.send(json.dumps(message))
+
+        sub = feedback.subscribe(client)
+        if sub is None:
+            # all stream threads taken: the page falls back to plain requests
+            ws.send(json.dumps({"type": "error", "error": "busy"}))
+            return
+        send({"type": "ready", "operator": operator})
+        pump(feedback, sub, lambda kind, data: send({"type": kind, "data": data}))
+        try:
+            while True:
+                try:
+                    message = json.loads(ws.receive())
+                except (TypeError, ValueError):
+                    continue
+                reply = control_message(operator, message, client) if isinstance(message, dict) else None
+                if reply:
+                    send(reply)
+        finally:
+            feedback.unsubscribe(sub)
+            control.release_all(operator)
+
+@app.route("/control/input", methods=["POST"])
+def control_input():
+    """HTTP fallback for /control when flask-sock isn't installed: a batch of key events."""
+    content = request.get_json(silent=True) or {}
+    if not control_authorized(content.get("password")):
+        return jsonify({"error": "unauthorized"}), 403
+    operator = str(content.get("operator") or "")
+    for event in content.get("events", []):
+        if isinstance(event, dict) and event.get("type") == "key":
+            control_message(operator, event, content.get("client"))
+    return jsonify({"status": "ok"})
+
+@app.route("/session", methods=["POST"])
+def session_start():
+    meta = request.get_json(silent=True) or {}
+    try:
+        session_id = start_session({"user_agent": str(meta.get("user_agent", ""))[:512],
+                                    "android": bool(meta.get("android"))})
+    except SessionFull as e:
+        return jsonify({"error": str(e)}), 507
+    return jsonify({"session": session_id})
 
-    return jsonify({"predicted_gesture": pred_label})
+@app.route("/session/<session_id>", methods=["POST"])
+def session_append(session_id):
+    # never read more than one request's worth into memory
+    if request.content_length is None or request.content_length > MAX_APPEND_BYTES:
+        return jsonify({"error": f"send at most {MAX_APPEND_BYTES} bytes with a Content-Length"}), 413
+    try:
+        count = append_records(session_id, request.get_data())
+    except SessionFull as e:
+        return jsonify({"error": str(e)}), 413
+    except FileNotFoundError:
+        return jsonify({"error": "unknown session"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"appended": count})
 
 if __name__ == "__main__":
     # ssl_context='adhoc' generates a temporary certificate for HTTPS
@@ -0,0 +1,196 @@
+"""
+Knowledge distillation of the gesture model into smaller students.
+
+    python model_training.py --distill [--max-accuracy-drop 0.01] [--export mlp_32_s4]
+
+Loads the trained model (the teacher), trains every student in STUDENTS on
+both the true labels and the teacher's predictions softened by TEMPERATURE
+(the student's logits are divided by the same temperature for the latter,
+and that loss scaled by T^2, as in Hinton et al.), and prints an
+accuracy / latency / size table measured on this machine, marking the Pareto
+optimal ones. Latency is measured the way the server classifies a window (a
+direct model call, not model.predict(), whose overhead would hide any
+difference). The fastest student within --max-accuracy-drop of the teacher
+(the smallest one if several are equally fast within the measurement noise,
+or the one named by --export) is saved as gesture_model_student.h5 plus a
+TF.js copy; run the detection server with
+GESTURE_MODEL_FILE=gesture_model_student.h5 to use it.
+
+Students may also look at fewer input features: stride > 1 averages
+consecutive time steps inside the model, so every student still takes the
+same 600 inputs and the server and page need no changes.
+"""
+import os
+import tempfile
+import time
+
+import numpy as np
+from tensorflow.keras.layers import Activation, AveragePooling1D, Dense, Flatten, Input, Rescaling, Reshape
+from tensorflow.keras.models import Model, Sequential, load_model
+
+STUDENT_MODEL_FILE = "gesture_model_student.h5"
+STUDENT_TFJS_DIR = "tfjs_model_student"
+
+# name -> (hidden layer sizes, time stride)
+STUDENTS = {
+    "mlp_128_64": ((128, 64), 1),
+    "mlp_64_32": ((64, 32), 1),
+    "mlp_32": ((32,), 1),
+    "mlp_64_32_s2": ((64, 32), 2),
+    "mlp_32_s4": ((32,), 4),
+    "mlp_16_s5": ((16,), 5),
+}
+TEMPERATURE = 3.0
+SOFT_WEIGHT = 0.7  # share of the teacher's soft targets in the training loss
+EPOCHS = 100
+BATCH_SIZE = 16
+LATENCY_RUNS = 300
+LATENCY_NOISE = 0.1  # latencies this close (share of the fastest) count as equal
+
+
+def build_student(hidden, stride, n_classes, time_steps=100, features=6):
+    layers = [Input(shape=(time_steps * features,))]
+    if stride > 1:
+        layers += [Reshape((time_steps, features)), AveragePooling1D(stride), Flatten()]
+    layers += [Dense(units, activation="relu") for units in hidden]
+    layers.append(Dense(n_classes, activation="softmax"))
+    model = Sequential(layers)
+    model.compile(optimizer="adam", loss="categorical_crossentropy", metrics=["accuracy"])
+    return model
+
+
+def soft_targets(teacher_probs, temperature=TEMPERATURE):
+    """The teacher's probabilities softened by temperature."""
+    logits = np.log(np.clip(teacher_probs, 1e-7, 1.0)) / temperature
+    soft = np.exp(logits - logits.max(axis=1, keepdims=True))
+    soft /= soft.sum(axis=1, keepdims=True)
+    return soft.astype(np.float32)
+
+
+def train_student(student, X, y_true, soft, temperature=TEMPERATURE, soft_weight=SOFT_WEIGHT):
+    """
+    Fit the student on the labels at temperature 1 and on the soft targets
+    at temperature. Its hidden layers are shared with a training model that
+    ends in plain logits; the trained logits become the student's softmax
+    layer, so the saved student is unchanged and runs at temperature 1.
+    """
+    inputs = Input(shape=student.input_shape[1:])
+    x = inputs
+    for layer in student.layers[:-1]:
+        x = layer(x)
+    logits_layer = Dense(student.output_shape[-1], name="logits")
+    logits = logits_layer(x)
+    trainer = Model(inputs, [Activation("softmax", name="hard")(logits),
+                             Activation("softmax", name="soft")(Rescaling(1 / temperature)(logits))])
+    # T^2 keeps the soft targets' gradients as large as the labels' at any temperature
+    trainer.compile(optimizer="adam", loss=["categorical_crossentropy", "categorical_crossentropy"],
+                    loss_weights=[1 - soft_weight, soft_weight * temperature ** 2])
+    trainer.fit(X, [y_true, soft], epochs=EPOCHS, batch_size=BATCH_SIZE, verbose=0)
+    student.layers[-1].set_weights(logits_layer.get_weights())
+
+
+def measure_latency(model, x, runs=LATENCY_RUNS):
+    """
+    Batch-1 latency in ms on the server's path (a direct call and .numpy()):
+    the median and the spread between the 25th and 75th percentile.
+    """
+    sample = x[:1]
+    for _ in range(10):
+        model(sample, training=False).numpy()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model(sample, training=False).numpy()
+        times.append(time.perf_counter() - start)
+    p25, p50, p75 = np.percentile(times, [25, 50, 75]) * 1000
+    return float(p50), float(p75 - p25)
+
+
+def model_size_kb(model):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "model.h5")
+        model.save(path, include_optimizer=False)
+        return os.path.getsize(path) / 1024
+
+
+def evaluate(name, model, X_test, y_test, teacher_pred=None):
+    pred = np.argmax(model.predict(X_test, verbose=0), axis=1)
+    latency_ms, spread_ms = measure_latency(model, X_test)
+    row = {"name": name, "model": model, "params": model.count_params(), "size_kb": model_size_kb(model),
+           "accuracy": float(np.mean(pred == np.argmax(y_test, axis=1))),
+           "latency_ms": latency_ms, "spread_ms": spread_ms}
+    row["agreement"] = float(np.mean(pred == teacher_pred)) if teacher_pred is not None else 1.0
+    return row
+
+
+def pareto_front(rows):
+    """Rows no other row beats on accuracy, latency and size at once."""
+    def dominates(a, b):
+        no_worse = a["accuracy"] >= b["accuracy"] and a["latency_ms"] <= b["latency_ms"] and a["size_kb"] <= b["size_kb"]
+        better = a["accuracy"] > b["accuracy"] or a["latency_ms"] < b["latency_ms"] or a["size_kb"] < b["size_kb"]
+        return no_worse and better
+    return [r for r in rows if not any(dominates(other, r) for other in rows if other is not r)]
+
+
+def noise_ms(row):
+    return max(row["spread_ms"], LATENCY_NOISE * row["latency_ms"])
+
+
+def print_table(rows, front):
+    print(f"{'model':14s} {'params':>8s} {'size KB':>8s} {'accuracy':>9s} {'agree':>6s} "
+          f"{'ms':>8s} {'+/- ms':>7s}  pareto")
+    for r in rows:
+        print(f"{r['name']:14s} {r['params']:8d} {r['size_kb']:8.1f} {r['accuracy']:9.3f} {r['agreement']:6.3f} "
+              f"{r['latency_ms']:8.3f} {r['spread_ms']:7.3f}  {'*' if r in front else ''}")
+
+
+def export_student(model):
+    model.save(STUDENT_MODEL_FILE, include_optimizer=False)
+    print(f"Student saved to {STUDENT_MODEL_FILE}")
+    try:
+        import tensorflowjs as tfjs
+    except ImportError:
+        print("tensorflowjs not installed, skipping the TF.js export")
+        return
+    tfjs.converters.save_keras_model(model, STUDENT_TFJS_DIR)
+    print(f"TF.js student saved to {STUDENT_TFJS_DIR}/")
+
+
+def distill(teacher_file, X_train, X_test, y_train, y_test, label_encoder, max_accuracy_drop=0.01, export=None):
+    teacher = load_model(teacher_file)
+    n_classes = y_train.shape[1]
+    if teacher.output_shape[-1] != n_classes or len(label_encoder.classes_) != n_classes:
+        raise SystemExit(f"{teacher_file} was trained on different gestures than the dataset, retrain it first")
+    if export and export not in STUDENTS:
+        raise SystemExit(f"unknown student {export!r}, choose from {', '.join(STUDENTS)}")
+
+    soft = soft_targets(teacher.predict(X_train, verbose=0))
+    teacher_pred = np.argmax(teacher.predict(X_test, verbose=0), axis=1)
+    rows = [evaluate("teacher", teacher, X_test, y_test)]
+
+    for name, (hidden, stride) in STUDENTS.items():
+        print(f"Training student {name}...")
+        student = build_student(hidden, stride, n_classes, X_train.shape[1] // 6)
+        train_student(student, X_train, y_train, soft)
+        rows.append(evaluate(name, student, X_test, y_test, teacher_pred))
+
+    front = pareto_front(rows)
+    print_table(rows, front)
+
+    students = [r for r in rows if r["name"] != "teacher"]
+    if export:
+        chosen = next(r for r in students if r["name"] == export)
+    else:
+        good_enough = [r for r in students if r["accuracy"] >= rows[0]["accuracy"] - max_accuracy_drop]
+        if not good_enough:
+            print(f"No student within {max_accuracy_drop:.1%} of the teacher's accuracy, nothing exported")
+            return None
+        chosen = min(good_enough, key=lambda r: r["latency_ms"])
+        equally_fast = [r for r in good_enough if r["latency_ms"] <= chosen["latency_ms"] + noise_ms(chosen)]
+        chosen = min(equally_fast, key=lambda r: r["size_kb"])
+    print(f"Exporting {chosen['name']}: accuracy {chosen['accuracy']:.3f}, "
+          f"{chosen['latency_ms']:.3f} ms per window, {chosen['size_kb']:.1f} KB")
+    if chosen["latency_ms"] > rows[0]["latency_ms"] - noise_ms(rows[0]):
+        print("It is not measurably faster than the teacher on this machine, only smaller")
+    export_student(chosen["model"])
+    return chosen["name"]
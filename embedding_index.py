@@ -0,0 +1,131 @@
+"""
+Few-shot gestures by nearest-neighbour lookup, no retraining.
+
+The Keras model's last hidden layer (128 values) is used as an embedding of
+a gesture window. The detection server keeps the embeddings of labelled
+recordings in an EmbeddingIndex and asks it for the k most similar ones
+(cosine similarity) on every prediction; a gesture the model was never
+trained on is recognized as soon as a few examples of it are in the index.
+
+Recordings reach the index through the server's /index/add (learning.py
+forwards every saved recording there when INDEX_URL is set) and are
+appended to embedding_index.jsonl as windows, not embeddings, so the index
+is rebuilt correctly after the model changes. Every server process follows
+that file, so all workers see new gestures within a request or two.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+INDEX_FILE = "embedding_index.jsonl"
+K = 5
+MIN_SIMILARITY = 0.9  # cosine similarity of the nearest neighbour
+MIN_VOTE = 0.6  # share of the k neighbours' similarity behind the winning label
+
+
+class EmbeddingIndex:
+    """
+    Unit-length embeddings in one preallocated float32 matrix that doubles
+    when full, so adding is amortized O(1) and a query is a single
+    matrix-vector product over the used rows.
+    """
+
+    def __init__(self, dim, capacity=1024):
+        self.dim = dim
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.label_ids = np.zeros(capacity, dtype=np.int32)
+        self.labels = []  # label id -> name
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def label_id(self, label):
+        if label not in self.labels:
+            self.labels.append(label)
+        return self.labels.index(label)
+
+    def add(self, embeddings, labels):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+        with self.lock:
+            ids = [self.label_id(label) for label in labels]
+            end = self.size + len(embeddings)
+            if end > len(self.vectors):
+                capacity = max(end, 2 * len(self.vectors))
+                self.vectors = np.resize(self.vectors, (capacity, self.dim))
+                self.label_ids = np.resize(self.label_ids, capacity)
+            self.vectors[self.size:end] = embeddings
+            self.label_ids[self.size:end] = ids
+            self.size = end
+
+    def query(self, embedding, k=K):
+        """The k nearest recordings as [(label, similarity), ...], most similar first."""
+        q = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        with self.lock:
+            vectors, ids, labels = self.vectors[:self.size], self.label_ids[:self.size], self.labels
+        if len(vectors) == 0:
+            return []
+        scores = vectors @ q
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(labels[ids[i]], float(scores[i])) for i in top]
+
+    def classify(self, embedding, k=K, min_similarity=MIN_SIMILARITY, min_vote=MIN_VOTE):
+        """
+        Similarity weighted vote of the k nearest recordings. Returns
+        (label, vote share, best similarity), label None if not confident.
+        """
+        neighbours = self.query(embedding, k)
+        if not neighbours or neighbours[0][1] < min_similarity:
+            return None, 0.0, neighbours[0][1] if neighbours else 0.0
+        votes = {}
+        for label, score in neighbours:
+            votes[label] = votes.get(label, 0.0) + max(score, 0.0)
+        label = max(votes, key=votes.get)
+        share = votes[label] / max(sum(votes.values()), 1e-12)
+        return (label if share >= min_vote else None), share, neighbours[0][1]
+
+    def counts(self):
+        with self.lock:
+            counts = np.bincount(self.label_ids[:self.size], minlength=len(self.labels))
+            return dict(zip(self.labels, counts.tolist()))
+
+
+class IndexFile:
+    """
+    Append-only JSON lines of {"gesture", "window", "command"} records. Each
+    reader remembers how far it got, so read_new() only parses what other
+    processes appended since.
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.offset = 0
+        self.lock = threading.Lock()
+
+    def append(self, records):
+        data = "".join(json.dumps(r) + "\n" for r in records).encode("utf-8")
+        # one write on an O_APPEND descriptor, so concurrent writers don't interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def read_new(self):
+        with self.lock:
+            try:
+                if os.path.getsize(self.path) <= self.offset:
+                    return []
+            except FileNotFoundError:
+                return []
+            with open(self.path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+            end = data.rfind(b"\n") + 1  # a line still being written is picked up next time
+            self.offset += end
+        return [json.loads(line) for line in data[:end].splitlines() if line.strip()]
@@ -0,0 +1,117 @@
+"""
+Feature-based gesture classifier, an alternative to the Keras model.
+
+Each (100, 6) window is reduced to a few dozen hand-made features per axis
+(peak value and position, sign of the first peak, energy, spread, zero
+crossings, integrals over each half, min, max), computed for whole batches
+with a handful of NumPy calls. A small scikit-learn model on top of them is
+enough to tell the flicks apart and predicts in microseconds without
+TensorFlow:
+
+    python model_training.py --backend features [--feature-model tree]
+    GESTURE_BACKEND=features python serve.py
+
+FeatureClassifier.predict() takes the same (n, 600) input and returns the
+same class probabilities as the Keras model's predict(), so the server uses
+either one the same way.
+"""
+import numpy as np
+
+from gesture_pipeline import AXES
+
+TIME_STEPS = 100
+FEATURES_MODEL_FILE = "gesture_features.pkl"
+FIRST_PEAK_FRACTION = 0.5  # the first peak is the first sample above this share of the largest one
+
+PER_AXIS = ["peak", "peak_pos", "first_peak_sign", "energy", "std", "zero_crossings",
+            "integral_first", "integral_second", "min", "max"]
+FEATURE_NAMES = [f"{axis}_{name}" for name in PER_AXIS for axis in AXES]
+
+
+def extract_features(X):
+    """(n, 600) or (n, 100, 6) windows -> (n, len(FEATURE_NAMES)) float32 features."""
+    W = np.asarray(X, dtype=np.float32).reshape(len(X), TIME_STEPS, len(AXES))
+    n, steps, axes = W.shape
+    # Single windows are the common case, so this sticks to few, cheap passes
+    # over the array: per call overhead dominates at this size.
+    rows, cols = np.arange(n)[:, np.newaxis], np.arange(axes)
+    lo, hi = W.min(axis=1), W.max(axis=1)
+    peak = np.where(hi >= -lo, hi, lo)
+    magnitude = np.abs(W)
+    peak_idx = magnitude.argmax(axis=1)
+    first_idx = (magnitude >= FIRST_PEAK_FRACTION * np.abs(peak)[:, np.newaxis]).argmax(axis=1)
+    first_sign = np.sign(W[rows, first_idx, cols])
+    half = steps // 2
+    first_half, second_half = W[:, :half].sum(axis=1), W[:, half:].sum(axis=1)
+    mean = (first_half + second_half) / steps
+    energy = np.einsum("ntk,ntk->nk", W, W) / steps
+    positive = W > 0
+    crossings = np.count_nonzero(positive[:, 1:] != positive[:, :-1], axis=1)
+    return np.concatenate([
+        peak,
+        peak_idx / (steps - 1),
+        first_sign,
+        energy,
+        np.sqrt(np.maximum(energy - mean * mean, 0)),
+        crossings / (steps - 1),
+        first_half / steps,
+        second_half / steps,
+        lo,
+        hi,
+    ], axis=1).astype(np.float32)
+
+
+class FeatureClassifier:
+    """
+    A fitted scikit-learn classifier on extract_features(). n_classes is the
+    number of label_encoder classes, probabilities come back in that order.
+    """
+
+    def __init__(self, estimator, n_classes):
+        self.estimator = estimator
+        self.n_classes = n_classes
+        self.classes = np.asarray(self._final_step().classes_)
+        self._linear = None
+        final = self._final_step()
+        if hasattr(final, "coef_") and len(self.classes) > 2:
+            # Softmax regression: evaluate it directly, sklearn's input
+            # validation costs more than the arithmetic for a single window.
+            mean, scale = self._scaling()
+            coef = final.coef_.T / scale[:, np.newaxis]
+            self._linear = (coef.astype(np.float32),
+                            (final.intercept_ - mean @ coef).astype(np.float32))
+
+    def _final_step(self):
+        return self.estimator.steps[-1][1] if hasattr(self.estimator, "steps") else self.estimator
+
+    def _scaling(self):
+        """mean and scale of the StandardScaler in front of the model, if there is one."""
+        for _, step in getattr(self.estimator, "steps", [])[:-1]:
+            if hasattr(step, "scale_"):
+                return step.mean_, step.scale_
+        return np.zeros(len(FEATURE_NAMES)), np.ones(len(FEATURE_NAMES))
+
+    def predict(self, X, verbose=0):
+        """Class probabilities, (n, n_classes), like keras Model.predict()."""
+        features = extract_features(X)
+        if self._linear is not None:
+            coef, intercept = self._linear
+            logits = features @ coef + intercept
+            e = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probs = e / e.sum(axis=1, keepdims=True)
+        else:
+            probs = self.estimator.predict_proba(features)
+        out = np.zeros((len(features), self.n_classes), dtype=np.float32)
+        out[:, self.classes] = probs
+        return out
+
+
+def build_estimator(kind="logistic"):
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.tree import DecisionTreeClassifier
+
+    if kind == "tree":
+        return DecisionTreeClassifier(max_depth=8, min_samples_leaf=3, random_state=42)
+    return make_pipeline(StandardScaler(), LogisticRegression(C=1.0, max_iter=2000))
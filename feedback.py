@@ -0,0 +1,139 @@
+"""
+Server-to-page feedback: command acknowledgements, robot latency and status.
+
+Pages subscribe with a client id (Server-Sent Events on /events, or their
+/control socket) and the server publishes messages to a FeedbackHub. Every
+subscriber has a small mailbox holding only the newest message of each kind,
+so a slow phone gets the current state instead of a growing backlog, and
+publishing never blocks the robot dispatcher.
+
+Each subscription holds a server thread for as long as the page stays open,
+so a hub takes at most max_subscriptions of them; subscribe() returns None
+beyond that and the page falls back to plain requests until one frees up.
+
+Messages:
+
+    ack     {"id", "command", "source", "ok", "robots": [...], "queue_ms", "server_ms"}
+            or {"id", "command", "source", "ok": false, "dropped": reason}
+    status  [{"robot", "connected", "last_latency_ms", "last_error"}, ...]
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+HEARTBEAT_SECONDS = 15
+STATUS_INTERVAL = 2.0
+
+
+class Subscription:
+    def __init__(self, client=None):
+        self.client = client
+        self.mailbox = OrderedDict()  # kind -> newest message
+        self.ready = threading.Condition()
+        self.dropped = 0  # messages replaced before the client got them
+        self.closed = False
+
+    def deliver(self, kind, data):
+        with self.ready:
+            if kind in self.mailbox:
+                self.dropped += 1
+                del self.mailbox[kind]
+            self.mailbox[kind] = data
+            self.ready.notify()
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+
+    def next(self, timeout=None):
+        """Wait for messages, returns a list of (kind, data), empty on timeout."""
+        with self.ready:
+            if not self.mailbox and not self.closed:
+                self.ready.wait(timeout)
+            messages = list(self.mailbox.items())
+            self.mailbox.clear()
+        return messages
+
+
+class FeedbackHub:
+    def __init__(self, max_subscriptions=None):
+        self.max_subscriptions = max_subscriptions
+        self.refused = 0
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+        self.last = {}  # kind -> newest client independent message, sent to new subscribers
+
+    def subscribe(self, client=None):
+        """A new Subscription, or None if max_subscriptions are open."""
+        sub = Subscription(client)
+        with self.lock:
+            if self.max_subscriptions is not None and len(self.subscriptions) >= self.max_subscriptions:
+                self.refused += 1
+                return None
+            self.subscriptions.add(sub)
+            for kind, data in self.last.items():
+                sub.deliver(kind, data)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscriptions.discard(sub)
+        sub.close()
+
+    def stats(self):
+        return {"subscriptions": len(self.subscriptions), "max_subscriptions": self.max_subscriptions,
+                "refused": self.refused}
+
+    def publish(self, kind, data, client=None):
+        """Send to every subscriber, or only to client's (and unfiltered ones) if given."""
+        with self.lock:
+            if client is None:
+                self.last[kind] = data
+            targets = [s for s in self.subscriptions if client is None or s.client in (None, client)]
+        for sub in targets:
+            sub.deliver(kind, data)
+
+    def poll(self, kind, source, interval=STATUS_INTERVAL):
+        """Check source() every interval seconds and publish it when it changed."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                if not self.subscriptions:
+                    continue
+                try:
+                    data = source()
+                    if data != self.last.get(kind):
+                        self.publish(kind, data)
+                except Exception as e:
+                    print(f"could not publish {kind}: {e}")
+        threading.Thread(target=loop, name=f"feedback-{kind}", daemon=True).start()
+
+
+def sse_stream(hub, sub):
+    """Server-Sent Events for one subscription, unsubscribes when the client goes away."""
+    try:
+        yield "retry: 2000\n\n"
+        while True:
+            messages = sub.next(HEARTBEAT_SECONDS)
+            if not messages:
+                yield ": keep-alive\n\n"  # also how a closed connection gets noticed
+            for kind, data in messages:
+                yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+    finally:
+        hub.unsubscribe(sub)
+
+
+def pump(hub, sub, send):
+    """Forward a subscription to send(kind, data) on a background thread, until send raises."""
+    def loop():
+        try:
+            while not sub.closed:
+                for kind, data in sub.next():
+                    send(kind, data)
+        except Exception:
+            pass
+        finally:
+            hub.unsubscribe(sub)
+    threading.Thread(target=loop, name="feedback-pump", daemon=True).start()
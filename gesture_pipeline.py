@@ -0,0 +1,126 @@
+"""
+Python port of the detection page's client side pipeline (HTML_PAGE in
+detection_server_preproc.py): axis correction, normalisation, smoothing,
+movement endpointing, cropping and resampling.
+
+Feed raw devicemotion samples one by one into GestureSegmenter and it yields
+the same 100x6 windows the phone would have posted to /predict. Used by
+replay.py to push recorded sessions through the server.
+"""
+import math
+
+import numpy as np
+
+AXES = ["x", "y", "z", "alpha", "beta", "gamma"]
+
+ALPHA_SMOOTH = 0.2
+MOVEMENT_THRESHOLD = 0.3
+QUIET_FRAMES_LIMIT = 20
+PRE_ROLL = 15  # samples kept while waiting for movement
+MAX_GESTURE_SAMPLES = 250  # failsafe, forces a prediction
+MIN_GESTURE_SAMPLES = 10
+PAUSE_MS = 500  # the page ignores motion this long after a real gesture
+WINDOW_LENGTH = 100
+
+
+def correct_axes(sample, android):
+    x, y, z, alpha, beta, gamma = sample
+    if android:
+        y, z = -z, y
+    return [x, y, z, alpha, beta, gamma]
+
+
+def normalize_sample(sample):
+    x, y, z, alpha, beta, gamma = sample
+    return [x / 20, y / 20, z / 20, alpha / 200, beta / 200, gamma / 200]
+
+
+class Smoother:
+    def __init__(self, alpha=ALPHA_SMOOTH):
+        self.alpha = alpha
+        self.last = [0.0] * 6
+
+    def __call__(self, sample):
+        self.last = [self.alpha * v + (1 - self.alpha) * last for v, last in zip(sample, self.last)]
+        return self.last
+
+
+def crop_bounds(samples, threshold=MOVEMENT_THRESHOLD, padding=15):
+    """(start, end) row indices of the moving part of samples plus padding, end inclusive."""
+    mag = np.sqrt(samples[:, 0] ** 2 + samples[:, 1] ** 2 + samples[:, 2] ** 2)
+    moving = np.flatnonzero(mag > threshold)
+    if len(moving) == 0:
+        return 0, len(samples) - 1
+    return max(0, moving[0] - padding), min(len(samples) - 1, moving[-1] + padding)
+
+
+def crop_recording(samples, threshold=MOVEMENT_THRESHOLD, padding=15):
+    """samples: (n, 6) array, cropped to the moving part plus padding."""
+    start, end = crop_bounds(samples, threshold, padding)
+    return samples[start:end + 1]
+
+
+def resample_linear(samples, target_length=WINDOW_LENGTH):
+    """Linear interpolation to target_length rows, same as the page's resample()."""
+    if len(samples) == target_length:
+        return samples
+    idx = np.arange(target_length) * (len(samples) - 1) / (target_length - 1)
+    low = np.floor(idx).astype(int)
+    high = np.ceil(idx).astype(int)
+    t = (idx - low)[:, np.newaxis]
+    return samples[low] * (1 - t) + samples[high] * t
+
+
+class GestureSegmenter:
+    """
+    Streaming endpointing, sample for sample the same state machine as the
+    devicemotion handler on the detection page.
+    """
+
+    def __init__(self, android=False):
+        self.android = android
+        self.smooth = Smoother()
+        self.buffer = []
+        self.moving = False
+        self.quiet_frames = 0
+        self.paused_until = None
+
+    def pause(self, timestamp):
+        """Call after a real gesture was recognised, like the page does."""
+        self.paused_until = timestamp + PAUSE_MS
+        self.buffer = []
+
+    def push(self, timestamp, raw):
+        """
+        raw: [x, y, z, alpha, beta, gamma] straight from devicemotion.
+        Returns a (100, 6) window when a gesture just ended, else None.
+        """
+        if self.paused_until is not None:
+            if timestamp < self.paused_until:
+                return None
+            self.paused_until = None
+
+        sample = self.smooth(normalize_sample(correct_axes(raw, self.android)))
+        mag = math.sqrt(sample[0] ** 2 + sample[1] ** 2 + sample[2] ** 2)
+        self.buffer.append(sample)
+
+        if not self.moving:
+            if len(self.buffer) > PRE_ROLL:
+                self.buffer.pop(0)
+            if mag > MOVEMENT_THRESHOLD:
+                self.moving = True
+                self.quiet_frames = 0
+            return None
+
+        self.quiet_frames = self.quiet_frames + 1 if mag < MOVEMENT_THRESHOLD else 0
+        if self.quiet_frames >= QUIET_FRAMES_LIMIT or len(self.buffer) > MAX_GESTURE_SAMPLES:
+            self.moving = False
+            self.quiet_frames = 0
+            return self._flush()
+        return None
+
+    def _flush(self):
+        buffer, self.buffer = self.buffer, []
+        if len(buffer) < MIN_GESTURE_SAMPLES:
+            return None
+        return resample_linear(crop_recording(np.array(buffer)))
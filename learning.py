@@ -1,9 +1,28 @@
-from flask import Flask, request, jsonify, render_template_string, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 import json
+import math
 import os
+import ssl
+import threading
+import time
+import urllib.request
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from werkzeug.exceptions import ClientDisconnected
+
+from dataset_tool import DatasetSummary
+from static_assets import StaticAssets
 
 app = Flask(__name__)
 DATA_FILE = "gesture_data.json"
+# New recordings are appended here first and folded into DATA_FILE in
+# batches, so saving a chunk doesn't rewrite the whole dataset.
+JOURNAL_FILE = DATA_FILE + ".journal"
+COMPACT_RECORDS = 200
+COMPACT_INTERVAL = 30  # seconds
 
 # Load existing data
 if os.path.exists(DATA_FILE):
@@ -12,6 +31,31 @@ if os.path.exists(DATA_FILE):
 else:
     gesture_data = []
 
+# Kept up to date on every save so /stats never rescans the dataset
+summary = DatasetSummary()
+for entry in gesture_data:
+    summary.add(entry)
+
+EXPORT_CHUNK = 64 * 1024
+UPLOAD_READ_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024  # decoded size of one /upload chunk
+SAMPLE_AXES = ("x", "y", "z", "alpha", "beta", "gamma")
+
+# Recording ids already stored, uploads are idempotent
+known_ids = {entry["id"] for entry in gesture_data if entry.get("id")}
+save_lock = threading.Lock()
+
+journal_count, journal_since = 0, 0.0  # recordings in the journal, when the oldest arrived
+
+# Forward saved recordings to the detection server's embedding index so new
+# gestures work there within seconds (see embedding_index.py), e.g.
+# INDEX_URL=https://192.168.1.10:8080/index/add. The server's certificate is
+# self-signed; set INDEX_CAFILE (e.g. its certs/server.crt) to verify it.
+INDEX_URL = os.environ.get("INDEX_URL")
+INDEX_TOKEN = os.environ.get("INDEX_TOKEN", "")
+INDEX_CAFILE = os.environ.get("INDEX_CAFILE")
+index_notifier = ThreadPoolExecutor(max_workers=1)
+
 HTML_PAGE = """
 <!DOCTYPE html>
 <html>
@@ -30,6 +74,8 @@ HTML_PAGE = """
     <button id="enableSensorsBtn">Enable Motion Sensors</button>
     <p id="status"></p>
 
+    <p>Collector name: <input id="collectorInput" placeholder="your name"></p>
+
     <p>Step 2: Select gesture to record:</p>
     <select id="gestureSelect">
         <option value="flick_front">Flick Front</option>
@@ -37,20 +83,31 @@ HTML_PAGE = """
         <option value="flick_left">Flick Side Left</option>
         <option value="flick_back">Flick Side Back</option>
         <option value="noise">Do Nothing / Noise</option>
+        <option value="custom">New gesture...</option>
     </select>
+    <p id="customFields" style="display:none">
+        Name: <input id="customGestureInput" placeholder="e.g. circle">
+        Robot command: <input id="commandInput" placeholder="e.g. spin">
+    </p>
     <br><br>
 
+    <label><input type="checkbox" id="keepRawCheckbox"> Also keep raw sensor data</label>
+    <br>
     <button id="recordBtn">Tap to Record 3s</button>
     <button id="submitBtn">Submit All Data</button>
     <p id="recordStatus"></p>
 
     <p>Step 3: Download dataset when done:</p>
     <a href="/download"><button>Download JSON Dataset</button></a>
+    <button id="statsBtn">Show Stats</button>
+    <pre id="statsOutput" style="text-align:left; display:inline-block;"></pre>
 
 <script>
 let permissionGranted = false;
 let buffer = [];
-let batchData = [];
+let batchData = JSON.parse(localStorage.getItem("pendingRecordings") || "[]");
+let uploading = false;
+const UPLOAD_CHUNK = 10; // recordings per request
 const recordDuration = 3000; // 3 seconds
 const alphaSmooth = 0.2;
 let lastSample = {x:0,y:0,z:0,alpha:0,beta:0,gamma:0};
@@ -61,6 +118,26 @@ const enableBtn = document.getElementById("enableSensorsBtn");
 const gestureSelect = document.getElementById("gestureSelect");
 const recordBtn = document.getElementById("recordBtn");
 const submitBtn = document.getElementById("submitBtn");
+const collectorInput = document.getElementById("collectorInput");
+const statsBtn = document.getElementById("statsBtn");
+const statsOutput = document.getElementById("statsOutput");
+const keepRawCheckbox = document.getElementById("keepRawCheckbox");
+const customFields = document.getElementById("customFields");
+const customGestureInput = document.getElementById("customGestureInput");
+const commandInput = document.getElementById("commandInput");
+gestureSelect.addEventListener("change", () => {
+    customFields.style.display = gestureSelect.value === "custom" ? "block" : "none";
+});
+
+// New gestures get a free-form name (and optionally the robot command they trigger)
+function selectedGesture() {
+    return gestureSelect.value === "custom" ? customGestureInput.value.trim() : gestureSelect.value;
+}
+keepRawCheckbox.checked = localStorage.getItem("keepRaw") === "1";
+keepRawCheckbox.addEventListener("change", () => localStorage.setItem("keepRaw", keepRawCheckbox.checked ? "1" : "0"));
+
+collectorInput.value = localStorage.getItem("collector") || "";
+collectorInput.addEventListener("change", () => localStorage.setItem("collector", collectorInput.value.trim()));
 
 // iOS motion permission
 enableBtn.addEventListener("click", async () => {
@@ -122,7 +199,7 @@ function cropRecording(samples, threshold=0.3, padding=15) {
     let start=0, end=samples.length-1;
 
     // If gesture is "noise", skip cropping
-    const gesture = gestureSelect.value;
+    const gesture = selectedGesture();
     if(gesture === "noise") return samples;
 
     for(let i=0;i<samples.length;i++){
@@ -139,9 +216,19 @@ function cropRecording(samples, threshold=0.3, padding=15) {
 // Record 3s
 recordBtn.addEventListener("click", () => {
     if (!permissionGranted) { recordStatus.textContent = "Enable motion sensors first!"; return; }
+    if (!/^[0-9a-zA-Z_.-]+$/.test(selectedGesture())) {
+        recordStatus.textContent = "Gesture names may only contain letters, digits, _ . -";
+        return;
+    }
 
     buffer=[];
-    const gesture = gestureSelect.value;
+    // Raw samples (before correctAxes) plus the smoothing state at the start,
+    // enough for preprocessing.py to re-derive the preprocessed data exactly.
+    const keepRaw = keepRawCheckbox.checked;
+    let rawSamples = [];
+    const smoothInit = [lastSample.x, lastSample.y, lastSample.z, lastSample.alpha, lastSample.beta, lastSample.gamma];
+    const gesture = selectedGesture();
+    const command = gestureSelect.value === "custom" ? commandInput.value.trim() : "";
     recordStatus.textContent = `Recording "${gesture}" for 3 seconds...`;
 
     function recordMotion(event){
@@ -153,10 +240,12 @@ recordBtn.addEventListener("click", () => {
             beta: event.rotationRate.beta || 0,
             gamma: event.rotationRate.gamma || 0
         };
+        const timestamp = Date.now();
+        if (keepRaw) rawSamples.push([timestamp, sample.x, sample.y, sample.z, sample.alpha, sample.beta, sample.gamma]);
         sample = correctAxes(sample);
         sample = normalizeSample(sample);
         sample = smoothSample(sample);
-        sample.timestamp = Date.now();
+        sample.timestamp = timestamp;
         buffer.push(sample);
     }
 
@@ -165,51 +254,411 @@ recordBtn.addEventListener("click", () => {
     setTimeout(()=>{
         window.removeEventListener("devicemotion", recordMotion);
         buffer = cropRecording(buffer);
-        batchData.push({gesture:gesture, samples:buffer});
+        let entry = {id:newRecordingId(), gesture:gesture, collector:collectorInput.value.trim() || null, samples:buffer};
+        if (command) entry.command = command;
+        if (keepRaw) {
+            entry.raw = {android:/Android/i.test(navigator.userAgent), smooth_init:smoothInit, samples:rawSamples};
+        }
+        batchData.push(entry);
+        savePending();
         recordStatus.textContent = `Recorded ${buffer.length} preprocessed samples for "${gesture}". Total in batch: ${batchData.length}`;
     }, recordDuration);
 });
 
+function newRecordingId(){
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + "-" + Math.random().toString(36).slice(2);
+}
+
+// Recordings stay in localStorage until the server confirmed them, so a
+// dropped connection or a reload doesn't lose anything.
+function savePending(){
+    try { localStorage.setItem("pendingRecordings", JSON.stringify(batchData)); }
+    catch (err) { console.error(err); }
+}
+
+// Recordings the server refused are set aside instead of being resent
+// forever, they stay in localStorage under "rejectedRecordings".
+function setAside(rejected){
+    if (rejected.length === 0) return;
+    const ids = new Set(rejected.map(r => r.id));
+    const kept = JSON.parse(localStorage.getItem("rejectedRecordings") || "[]");
+    kept.push(...batchData.filter(r => ids.has(r.id)));
+    batchData = batchData.filter(r => !ids.has(r.id));
+    try { localStorage.setItem("rejectedRecordings", JSON.stringify(kept)); }
+    catch (err) { console.error(err); }
+    rejected.forEach(r => console.warn(`recording ${r.id} rejected: ${r.problem}`));
+}
+
+async function encodeChunk(recordings){
+    const ndjson = recordings.map(r => JSON.stringify(r)).join("\n") + "\n";
+    if (typeof CompressionStream === "undefined") return {body: ndjson, headers: {}};
+    const stream = new Blob([ndjson]).stream().pipeThrough(new CompressionStream("gzip"));
+    return {body: await new Response(stream).blob(), headers: {"Content-Encoding": "gzip"}};
+}
+
+// Upload pending recordings in small compressed chunks. Every recording has
+// an id, so resending a chunk after a failure never creates duplicates.
+async function uploadPending(){
+    if (uploading) return;
+    uploading = true;
+    let failures = 0;
+    let uploaded = 0;
+    let rejected = 0;
+    while (batchData.length > 0) {
+        const chunk = batchData.slice(0, UPLOAD_CHUNK);
+        try {
+            const {body, headers} = await encodeChunk(chunk);
+            const res = await fetch("/upload", {
+                method:"POST",
+                headers:Object.assign({"Content-Type":"application/x-ndjson"}, headers),
+                body:body
+            });
+            const result = await res.json();
+            const done = new Set(result.accepted.concat(result.duplicates));
+            batchData = batchData.filter(r => !done.has(r.id));
+            setAside(result.rejected || []);
+            savePending();
+            uploaded += result.accepted.length;
+            rejected += (result.rejected || []).length;
+            if (!res.ok) throw new Error(result.message);
+            failures = 0;
+            recordStatus.textContent = `Uploaded ${uploaded}, ${batchData.length} left...`;
+        } catch (err) {
+            console.error(err);
+            if (++failures > 5) {
+                recordStatus.textContent = `Connection problems, ${batchData.length} recordings kept for later.`;
+                uploading = false;
+                return;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+        }
+    }
+    uploading = false;
+    recordStatus.textContent = rejected
+        ? `Saved ${uploaded} recordings, ${rejected} were malformed and set aside.`
+        : `Saved ${uploaded} recordings successfully.`;
+    showStats();
+}
+
 // Submit batch
 submitBtn.addEventListener("click", ()=>{
     if(batchData.length===0){ recordStatus.textContent="No recordings to submit!"; return; }
+    uploadPending();
+});
 
-    fetch("/save_batch", {
-        method:"POST",
-        headers:{"Content-Type":"application/json"},
-        body:JSON.stringify({batch:batchData})
-    })
+// Per-gesture counts straight from the server's running summary
+function showStats(){
+    fetch("/stats")
     .then(res=>res.json())
-    .then(res=>{ recordStatus.textContent=res.message; batchData=[]; })
-    .catch(err=>{ console.error(err); recordStatus.textContent="Error submitting batch"; });
-});
+    .then(stats=>{
+        let lines = Object.entries(stats.gestures).map(([g, s]) =>
+            `${g}: ${s.count} recordings, avg ${s.mean_len.toFixed(0)} samples` +
+            (s.sample_rate_hz ? `, ${s.sample_rate_hz.mean.toFixed(0)} Hz` : ""));
+        lines.push(`total: ${stats.total}`);
+        statsOutput.textContent = lines.join("\n");
+    })
+    .catch(err=>{ console.error(err); statsOutput.textContent="Error loading stats"; });
+}
+statsBtn.addEventListener("click", showStats);
+if (batchData.length) recordStatus.textContent = `${batchData.length} recordings waiting to be submitted`;
+window.addEventListener("online", () => { if (batchData.length) uploadPending(); });
 </script>
 </body>
 </html>
 """
 
+# The page is compressed once and kept on the phone by a service worker
+# (static_assets.py), so recording keeps working while offline.
+assets = StaticAssets(app, "learning")
+assets.add_page("/", HTML_PAGE)
+assets.install()
+
 @app.route("/")
 def index():
-    return render_template_string(HTML_PAGE)
+    return assets.page("/")
 
 @app.route("/save_batch", methods=["POST"])
 def save_batch():
-    global gesture_data
-    content = request.get_json()
-    batch = content.get("batch")
-    if not batch:
+    content = request.get_json(silent=True)
+    batch = content.get("batch") if isinstance(content, dict) else None
+    if not batch or not isinstance(batch, list):
         return jsonify({"message":"No data received"}), 400
+    for entry in batch:
+        problem = recording_problem(entry)
+        if problem:
+            return jsonify({"message": f"Bad recording: {problem}"}), 400
 
-    gesture_data.extend(batch)
+    stored = store_recordings(batch)
+    forward_to_index(stored)
+
+    return jsonify({"message": f"Saved batch of {len(batch)} recordings successfully."})
 
-    with open(DATA_FILE, "w") as f:
+def recording_problem(entry, need_id=False):
+    """Why entry can't be stored, or None. Checked before any state is touched."""
+    if not isinstance(entry, dict):
+        return "recordings must be JSON objects"
+    if need_id and not entry.get("id"):
+        return "recordings need an id"
+    if entry.get("id") is not None and not isinstance(entry["id"], str):
+        return "id must be a string"
+    if not isinstance(entry.get("gesture"), str) or not entry["gesture"]:
+        return "recordings need a gesture"
+    samples = entry.get("samples")
+    if not isinstance(samples, list) or not all(isinstance(s, dict) for s in samples):
+        return "samples must be a list of objects"
+    for i, s in enumerate(samples):
+        for key in SAMPLE_AXES:
+            if not is_number(s.get(key)):
+                return f"sample {i}: {key} must be a number"
+        if "timestamp" in s and not is_number(s["timestamp"]):
+            return f"sample {i}: timestamp must be a number"
+    return None
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def store_recordings(entries):
+    """
+    Add validated recordings whose ids weren't stored before and append
+    them to the journal. Returns the ones added.
+    """
+    with save_lock:
+        stored = []
+        for entry in entries:
+            if entry.get("id") in known_ids:
+                continue
+            entry.setdefault("id", uuid.uuid4().hex)
+            entry.setdefault("saved_at", int(time.time() * 1000))
+            known_ids.add(entry["id"])
+            summary.add(entry)
+            gesture_data.append(entry)
+            stored.append(entry)
+        if stored:
+            append_journal(stored)
+    return stored
+
+def notify_index(entries):
+    body = json.dumps({"recordings": [{"gesture": e["gesture"], "samples": e["samples"], "command": e.get("command")}
+                                      for e in entries]}).encode("utf-8")
+    req = urllib.request.Request(INDEX_URL, data=body, headers={"Content-Type": "application/json",
+                                                                "X-Index-Token": INDEX_TOKEN})
+    context = None
+    if INDEX_URL.startswith("https:"):
+        context = ssl.create_default_context(cafile=INDEX_CAFILE)
+        if not INDEX_CAFILE:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+    try:
+        with urllib.request.urlopen(req, timeout=10, context=context) as res:
+            print(f"embedding index: {json.loads(res.read())}")
+    except (OSError, ValueError) as e:
+        print(f"could not add recordings to the embedding index: {e}")
+
+def forward_to_index(entries):
+    """Send new recordings to the detection server in the background."""
+    if INDEX_URL and entries:
+        index_notifier.submit(notify_index, entries)
+
+def write_dataset():
+    # write to a temporary file first so an interrupted save can't corrupt the dataset
+    tmp_file = DATA_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
         json.dump(gesture_data, f, indent=2)
+    os.replace(tmp_file, DATA_FILE)
 
-    return jsonify({"message": f"Saved batch of {len(batch)} recordings successfully."})
+def append_journal(entries):
+    """Make new recordings durable with one small append. Caller holds save_lock."""
+    global journal_count, journal_since
+    with open(JOURNAL_FILE, "ab") as f:
+        f.write("".join(json.dumps(e) + "\n" for e in entries).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+    if not journal_count:
+        journal_since = time.monotonic()
+    journal_count += len(entries)
+
+def compact():
+    """Fold the journal into DATA_FILE."""
+    global journal_count
+    with save_lock:
+        if not journal_count:
+            return
+        write_dataset()
+        os.remove(JOURNAL_FILE)
+        journal_count = 0
+
+def compact_loop():
+    while True:
+        time.sleep(1)
+        if journal_count >= COMPACT_RECORDS or (journal_count and time.monotonic() - journal_since >= COMPACT_INTERVAL):
+            try:
+                compact()
+            except OSError as e:
+                print(f"could not write {DATA_FILE}: {e}")
+
+def replay_journal():
+    """Recordings saved before a restart but not compacted yet."""
+    if not os.path.exists(JOURNAL_FILE):
+        return
+    with open(JOURNAL_FILE, "rb") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn last line
+            if entry.get("id") not in known_ids:
+                known_ids.add(entry.get("id"))
+                summary.add(entry)
+                gesture_data.append(entry)
+    write_dataset()
+    os.remove(JOURNAL_FILE)
+
+replay_journal()
+threading.Thread(target=compact_loop, name="compact", daemon=True).start()
+
+def iter_upload_lines(stream, gzipped, limit=MAX_UPLOAD_BYTES):
+    """Yield the lines of a (gzip compressed) NDJSON body as it arrives."""
+    decoder = zlib.decompressobj(31) if gzipped else None
+    pending = b""
+    size = 0
+    while True:
+        data = stream.read(UPLOAD_READ_SIZE)
+        if not data:
+            break
+        if decoder:
+            data = decoder.decompress(data, limit - size + 1)
+        size += len(data)
+        if size > limit:
+            raise ValueError(f"chunk larger than {limit} bytes")
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        yield from lines
+    if decoder:
+        pending += decoder.flush()
+    if pending:
+        yield pending
+
+@app.route("/upload", methods=["POST"])
+def upload():
+    """
+    Chunked upload from the collector page: newline separated JSON
+    recordings, optionally gzip compressed. The chunk is read and checked
+    before anything is stored, so a slow phone never holds up other saves;
+    ids that were stored before are reported as duplicates, so the client
+    can simply resend whatever wasn't confirmed. Recordings that are
+    malformed are skipped and reported as rejected, resending them won't help.
+    """
+    gzipped = request.headers.get("Content-Encoding", "").lower() == "gzip"
+    entries = []
+    rejected = []
+    error = None
+    try:
+        for line in iter_upload_lines(request.stream, gzipped):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            problem = recording_problem(entry, need_id=True)
+            if problem and isinstance(entry, dict) and isinstance(entry.get("id"), str) and entry["id"]:
+                print(f"rejected recording {entry['id']}: {problem}")
+                rejected.append({"id": entry["id"], "problem": problem})
+                continue
+            if problem:
+                raise ValueError(problem)
+            entries.append(entry)
+    except (ValueError, zlib.error, OSError, ClientDisconnected) as e:
+        # keep whatever arrived intact, the client resends the rest
+        error = str(e) or e.__class__.__name__
+    stored = store_recordings(entries)
+    forward_to_index(stored)
+
+    new_ids = {e["id"] for e in stored}
+    accepted = [e["id"] for e in entries if e["id"] in new_ids]
+    duplicates = [e["id"] for e in entries if e["id"] not in new_ids]
+    result = {"accepted": accepted, "duplicates": duplicates, "rejected": rejected}
+    if error:
+        result["message"] = f"Upload interrupted: {error}"
+        return jsonify(result), 400
+    result["message"] = f"Saved {len(accepted)} recordings" + (f", rejected {len(rejected)}." if rejected else ".")
+    return jsonify(result)
 
 @app.route("/download")
 def download():
+    compact()
     return send_file(DATA_FILE, as_attachment=True)
 
+def recorded_at(entry):
+    """Epoch ms of a recording: its first sample, or when it was saved."""
+    samples = entry.get("samples") or [{}]
+    return samples[0].get("timestamp", entry.get("saved_at"))
+
+def parse_time(value):
+    """Epoch milliseconds or an ISO 8601 date/time -> epoch ms."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp() * 1000
+
+def entry_filter(args):
+    gestures = set(filter(None, args.get("gesture", "").split(",")))
+    collectors = set(filter(None, args.get("collector", "").split(",")))
+    since, until = parse_time(args.get("since")), parse_time(args.get("until"))
+
+    def keep(entry):
+        if gestures and entry.get("gesture") not in gestures:
+            return False
+        if collectors and entry.get("collector") not in collectors:
+            return False
+        if since is not None or until is not None:
+            t = recorded_at(entry)
+            if t is None or (since is not None and t < since) or (until is not None and t >= until):
+                return False
+        return True
+    return keep
+
+@app.route("/export")
+def export():
+    """
+    Stream the dataset, optionally filtered:
+    /export?gesture=flick_left,noise&collector=alice&since=2025-03-01&until=1767225600000&compress=gzip
+    """
+    try:
+        keep = entry_filter(request.args)
+    except ValueError as e:
+        return jsonify({"message": f"Bad time filter: {e}"}), 400
+    compress = request.args.get("compress") == "gzip"
+    entries = list(gesture_data)  # snapshot, saves may append meanwhile
+
+    def generate():
+        gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        pending, size, first = ["["], 1, True
+        for entry in entries:
+            if not keep(entry):
+                continue
+            text = ("\n" if first else ",\n") + json.dumps(entry)
+            first = False
+            pending.append(text)
+            size += len(text)
+            if size >= EXPORT_CHUNK:
+                chunk = "".join(pending).encode("utf-8")
+                pending, size = [], 0
+                chunk = gz.compress(chunk) if gz else chunk
+                if chunk:
+                    yield chunk
+        pending.append("\n]\n")
+        chunk = "".join(pending).encode("utf-8")
+        yield gz.compress(chunk) + gz.flush() if gz else chunk
+
+    filename = "gesture_data.json.gz" if compress else "gesture_data.json"
+    return Response(stream_with_context(generate()),
+                    mimetype="application/gzip" if compress else "application/json",
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+@app.route("/stats")
+def stats():
+    return jsonify(summary.as_dict())
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=6666)
\ No newline at end of file
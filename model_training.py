@@ -1,11 +1,21 @@
+import argparse
 import json
+import pickle
+import time
+import thread_config
+thread_config.apply("training")  # thread counts from autotune.py, before numpy/TensorFlow start
 import numpy as np
+import tensorflow as tf
 import tensorflowjs as tfjs
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Dropout
 from tensorflow.keras.utils import to_categorical
 from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import train_test_split
+from augmentation import GestureAugmenter, augmented_batches
+from dataset_tool import deduplicate
+from distillation import distill
+from features import FeatureClassifier, build_estimator, extract_features, FEATURE_NAMES, FEATURES_MODEL_FILE
 
 # File paths
 DATA_FILE = "gesture_data_resampled.json"
@@ -14,11 +24,32 @@ MODEL_FILE = "gesture_model.h5"
 # Parameters
 INPUT_TIME_STEPS = 100
 INPUT_FEATURES = 6  # x, y, z, alpha, beta, gamma
+BATCH_SIZE = 16
+AUGMENT = True  # augment training batches on the fly (see augmentation.py)
+FEATURE_AUGMENT_COPIES = 4  # features backend: augmented copies added to the training set
+
+parser = argparse.ArgumentParser(description="Train the gesture model.")
+parser.add_argument("--distill", action="store_true",
+                    help="train small student models from the saved model instead (see distillation.py)")
+parser.add_argument("--max-accuracy-drop", type=float, default=0.01,
+                    help="distill: export the fastest student at most this much less accurate than the teacher")
+parser.add_argument("--export", help="distill: export this student instead of picking one")
+parser.add_argument("--backend", choices=["keras", "features"], default="keras",
+                    help="features: train a small scikit-learn model on hand-made features (see features.py)")
+parser.add_argument("--feature-model", choices=["logistic", "tree"], default="logistic",
+                    help="features backend: classifier on top of the features")
+args = parser.parse_args()
 
 # 1️⃣ Load dataset
 with open(DATA_FILE, "r") as f:
     data = json.load(f)
 
+# Identical recordings would end up on both sides of the split and inflate accuracy
+unique = deduplicate(data)
+if len(unique) < len(data):
+    print(f"Dropped {len(data) - len(unique)} duplicate recordings")
+data = unique
+
 X = []
 y = []
 
@@ -32,7 +63,7 @@ for entry in data:
     X.append(flat_sample)
     y.append(gesture)
 
-X = np.array(X)
+X = np.array(X, dtype=np.float32)
 y = np.array(y)
 
 print(f"Dataset: {X.shape[0]} samples, input dimension {X.shape[1]}")
@@ -47,32 +78,89 @@ X_train, X_test, y_train, y_test = train_test_split(
     X, y_categorical, test_size=0.2, random_state=42, stratify=y_categorical
 )
 
-# 4️⃣ Build simple fully connected model
-model = Sequential([
-    Dense(256, input_dim=INPUT_TIME_STEPS*INPUT_FEATURES, activation='relu'),
-    Dropout(0.3),
-    Dense(128, activation='relu'),
-    Dropout(0.3),
-    Dense(y_categorical.shape[1], activation='softmax')
-])
-
-model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
-model.summary()
-
-# 5️⃣ Train
-history = model.fit(
-    X_train, y_train,
-    validation_data=(X_test, y_test),
-    epochs=50,
-    batch_size=16
-)
 
-# 6️⃣ Save model
-model.save(MODEL_FILE)
-print(f"Model saved to {MODEL_FILE}")
+def train_teacher(X_train, X_test, y_train, y_test, le):
+    # 4️⃣ Build simple fully connected model
+    model = Sequential([
+        Dense(256, input_dim=INPUT_TIME_STEPS*INPUT_FEATURES, activation='relu'),
+        Dropout(0.3),
+        Dense(128, activation='relu'),
+        Dropout(0.3),
+        Dense(y_train.shape[1], activation='softmax')
+    ])
 
-# 7️⃣ Save label encoder for inference
-import pickle
-with open("label_encoder.pkl", "wb") as f:
-    pickle.dump(le, f)
-print("Label encoder saved to label_encoder.pkl")
\ No newline at end of file
+    model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    model.summary()
+
+    # 5️⃣ Train
+    if AUGMENT:
+        # Batches are augmented lazily, a new random variant every epoch, and
+        # prefetched so NumPy runs while the previous step trains.
+        augmenter = GestureAugmenter(seed=42)
+        train_data = tf.data.Dataset.from_generator(
+            lambda: augmented_batches(X_train, y_train.astype(np.float32), BATCH_SIZE, augmenter),
+            output_signature=(
+                tf.TensorSpec(shape=(None, X_train.shape[1]), dtype=tf.float32),
+                tf.TensorSpec(shape=(None, y_train.shape[1]), dtype=tf.float32),
+            ),
+        ).prefetch(tf.data.AUTOTUNE)
+        history = model.fit(
+            train_data,
+            validation_data=(X_test, y_test),
+            epochs=50
+        )
+    else:
+        history = model.fit(
+            X_train, y_train,
+            validation_data=(X_test, y_test),
+            epochs=50,
+            batch_size=BATCH_SIZE
+        )
+
+    # 6️⃣ Save model
+    model.save(MODEL_FILE)
+    print(f"Model saved to {MODEL_FILE}")
+
+    # 7️⃣ Save label encoder for inference
+    with open("label_encoder.pkl", "wb") as f:
+        pickle.dump(le, f)
+    print("Label encoder saved to label_encoder.pkl")
+
+
+def train_features(X_train, X_test, y_train, y_test, le, kind):
+    # 4️⃣ Fit a small classifier on extracted features
+    y_train_idx = np.argmax(y_train, axis=1)
+    if AUGMENT:
+        augmenter = GestureAugmenter(seed=42)
+        X_fit = np.concatenate([X_train] + [augmenter(X_train) for _ in range(FEATURE_AUGMENT_COPIES)])
+        y_fit = np.tile(y_train_idx, FEATURE_AUGMENT_COPIES + 1)
+    else:
+        X_fit, y_fit = X_train, y_train_idx
+    classifier = FeatureClassifier(build_estimator(kind).fit(extract_features(X_fit), y_fit), len(le.classes_))
+
+    # 5️⃣ Evaluate
+    accuracy = np.mean(np.argmax(classifier.predict(X_test), axis=1) == np.argmax(y_test, axis=1))
+    start = time.perf_counter()
+    for x in X_test[:200]:
+        classifier.predict(x[np.newaxis])
+    per_window_us = (time.perf_counter() - start) / min(len(X_test), 200) * 1e6
+    print(f"{kind} on {len(FEATURE_NAMES)} features: test accuracy {accuracy:.3f}, "
+          f"{per_window_us:.0f} us per window")
+
+    # 6️⃣ Save model and label encoder
+    with open(FEATURES_MODEL_FILE, "wb") as f:
+        pickle.dump(classifier, f)
+    print(f"Model saved to {FEATURES_MODEL_FILE}")
+    with open("label_encoder.pkl", "wb") as f:
+        pickle.dump(le, f)
+    print("Label encoder saved to label_encoder.pkl")
+
+
+if args.backend == "features":
+    train_features(X_train, X_test, y_train, y_test, le, args.feature_model)
+elif args.distill:
+    # 4️⃣ Distill the trained model into smaller, faster students
+    distill(MODEL_FILE, X_train, X_test, y_train, y_test, le,
+            max_accuracy_drop=args.max_accuracy_drop, export=args.export)
+else:
+    train_teacher(X_train, X_test, y_train, y_test, le)
@@ -0,0 +1,211 @@
+"""
+Per-operator output heads on top of the shared gesture model.
+
+The shared model's hidden layers (Dense 256 -> Dense 128) act as a backbone;
+each operator gets their own small softmax layer, fine-tuned from a handful of
+calibration recordings and stored as heads/<operator>.npz (a few KB instead
+of a whole 2 MB model). Train one from recordings collected with learning.py
+under that operator's collector name:
+
+    python personalization.py alice --data gesture_data.json
+
+The detection server keeps the heads it needs in a HeadCache, an LRU cache
+bounded by memory, and applies them per session when the page sends an
+operator name.
+"""
+import argparse
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+HEAD_DIR = "heads"
+MISSING_RECHECK_SECONDS = 30  # how long "no head for this operator" is remembered
+MAX_MISSING = 1024  # operators without a head remembered at once
+RELOAD_CHECK_SECONDS = 5  # how often a cached head's file is checked for changes
+
+_OPERATOR = re.compile(r"^[0-9a-zA-Z_.-]{1,64}$")
+
+
+def head_path(operator):
+    if not _OPERATOR.match(operator):
+        raise ValueError("invalid operator name")
+    return os.path.join(HEAD_DIR, operator + ".npz")
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def embedding_model(model):
+    """The shared model without its output layer: 600 inputs -> 128-d embedding."""
+    from tensorflow.keras.models import Model
+    return Model(inputs=model.inputs[0], outputs=model.layers[-2].output)
+
+
+def softmax(logits):
+    e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class Head:
+    def __init__(self, kernel, bias):
+        self.kernel = np.asarray(kernel, dtype=np.float32)
+        self.bias = np.asarray(bias, dtype=np.float32)
+
+    @property
+    def nbytes(self):
+        return self.kernel.nbytes + self.bias.nbytes
+
+    def __call__(self, embedding):
+        return softmax(embedding @ self.kernel + self.bias)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # a running server may reload the head any moment, never let it see half a file
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, kernel=self.kernel, bias=self.bias)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["kernel"], data["bias"])
+
+
+class HeadCache:
+    """
+    Operator heads loaded lazily from HEAD_DIR, least recently used ones
+    evicted once their total size exceeds max_bytes. A head whose file
+    changed (checked at most every RELOAD_CHECK_SECONDS) is loaded again, so
+    retraining an operator's head needs no server restart.
+    """
+
+    def __init__(self, max_bytes, kernel_shape=None):
+        self.max_bytes = max_bytes
+        self.kernel_shape = kernel_shape  # (embedding size, classes) of the current model
+        self.heads = OrderedDict()
+        self.versions = {}  # operator -> (mtime of the loaded file, time it was last compared)
+        self.missing = OrderedDict()  # operator -> time of the failed lookup, oldest first
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, operator):
+        # operator comes straight from the request, don't remember names that can't have a head
+        if not isinstance(operator, str) or not _OPERATOR.match(operator):
+            return None
+        now = time.monotonic()
+        with self.lock:
+            head = self.heads.get(operator)
+            if head is not None:
+                self.heads.move_to_end(operator)
+                loaded_mtime, checked = self.versions[operator]
+                if now - checked < RELOAD_CHECK_SECONDS:
+                    return head
+                self.versions[operator] = (loaded_mtime, now)
+            elif now - self.missing.get(operator, -MISSING_RECHECK_SECONDS) < MISSING_RECHECK_SECONDS:
+                return None
+
+        path = head_path(operator)
+        if head is not None:
+            if file_mtime(path) == loaded_mtime:
+                return head
+            print(f"head for {operator} changed, reloading it")
+        try:
+            mtime = file_mtime(path)
+            head = Head.load(path) if mtime is not None else None
+        except (ValueError, OSError) as e:
+            print(f"could not load head for {operator}: {e}")
+            head = None
+        if head is not None and self.kernel_shape and head.kernel.shape != tuple(self.kernel_shape):
+            print(f"head for {operator} doesn't fit the current model, ignoring it")
+            head = None
+
+        with self.lock:
+            old = self.heads.pop(operator, None)
+            self.versions.pop(operator, None)
+            if old is not None:
+                self.size -= old.nbytes
+            if head is None:
+                self.missing.pop(operator, None)
+                self.missing[operator] = time.monotonic()
+                while len(self.missing) > MAX_MISSING:
+                    self.missing.popitem(last=False)
+                return None
+            self.missing.pop(operator, None)
+            self.heads[operator] = head
+            self.versions[operator] = (mtime, time.monotonic())
+            self.size += head.nbytes
+            while self.size > self.max_bytes and len(self.heads) > 1:
+                evicted_operator, evicted = self.heads.popitem(last=False)
+                self.versions.pop(evicted_operator, None)
+                self.size -= evicted.nbytes
+            return head
+
+
+def fine_tune_head(embeddings, labels, kernel, bias, epochs=300, lr=0.05, pull=0.01):
+    """
+    Softmax regression on the embeddings, starting from the shared output
+    layer and pulled back towards it, so a few recordings don't overfit.
+    """
+    init_kernel, init_bias = kernel.copy(), bias.copy()
+    kernel, bias = kernel.copy(), bias.copy()
+    onehot = np.eye(kernel.shape[1], dtype=np.float32)[labels]
+    n = len(embeddings)
+    for _ in range(epochs):
+        grad = (softmax(embeddings @ kernel + bias) - onehot) / n
+        kernel -= lr * (embeddings.T @ grad + pull * (kernel - init_kernel))
+        bias -= lr * (grad.sum(axis=0) + pull * (bias - init_bias))
+    return Head(kernel, bias)
+
+
+def main():
+    from tensorflow.keras.models import load_model
+    from resample import resample_samples, TARGET_LENGTH
+    from gesture_pipeline import AXES
+
+    parser = argparse.ArgumentParser(description="Fine-tune a personal output head for one operator.")
+    parser.add_argument("operator")
+    parser.add_argument("--data", default="gesture_data.json", help="dataset from learning.py")
+    parser.add_argument("--collector", help="collector name of the calibration recordings (default: operator)")
+    parser.add_argument("--model", default="gesture_model.h5")
+    parser.add_argument("--label-encoder", default="label_encoder.pkl")
+    parser.add_argument("--epochs", type=int, default=300)
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    with open(args.label_encoder, "rb") as f:
+        label_encoder = pickle.load(f)
+    with open(args.data) as f:
+        data = json.load(f)
+
+    collector = args.collector or args.operator
+    known = set(label_encoder.classes_)
+    recordings = [e for e in data if e.get("collector") == collector and e["gesture"] in known and e["samples"]]
+    if not recordings:
+        raise SystemExit(f"no calibration recordings from collector {collector!r} in {args.data}")
+
+    X = np.array([[s[axis] for s in resample_samples(e["samples"], TARGET_LENGTH) for axis in AXES]
+                  for e in recordings], dtype=np.float32)
+    y = label_encoder.transform([e["gesture"] for e in recordings])
+    embeddings = embedding_model(model).predict(X, verbose=0)
+
+    kernel, bias = model.layers[-1].get_weights()
+    head = fine_tune_head(embeddings, y, kernel, bias, epochs=args.epochs)
+    before = np.mean(np.argmax(softmax(embeddings @ kernel + bias), axis=1) == y)
+    after = np.mean(np.argmax(head(embeddings), axis=1) == y)
+    head.save(head_path(args.operator))
+    print(f"{len(recordings)} calibration recordings, accuracy on them {before:.1%} -> {after:.1%}")
+    print(f"Head saved to {head_path(args.operator)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Bulk re-preprocessing of raw recordings.
+
+learning.py can keep the raw devicemotion samples of every recording
+("Also keep raw sensor data"). This module re-applies the collector page's
+correctAxes / normalizeSample / smoothSample / cropRecording to them with
+NumPy, vectorized over whole batches of recordings and spread over several
+processes. With the default constants the output is bit-for-bit what the
+phone produced, so any variant of the preprocessing can be derived from the
+existing data instead of re-recording it:
+
+    python preprocessing.py gesture_data.json -o variant.json --alpha 0.3 --accel-scale 15
+
+The output has the same format as learning.py's dataset (feed it to
+resample.py as usual). Recordings saved without raw data are left out.
+"""
+import argparse
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from gesture_pipeline import AXES, ALPHA_SMOOTH, MOVEMENT_THRESHOLD, crop_bounds
+
+ACCEL_SCALE = 20
+GYRO_SCALE = 200
+CROP_PADDING = 15
+CHUNK_SIZE = 256  # recordings per vectorized batch / worker task
+
+Variant = namedtuple("Variant", ["accel_scale", "gyro_scale", "alpha", "threshold", "padding",
+                                 "axis_correction", "smooth_init"])
+DEFAULT_VARIANT = Variant(ACCEL_SCALE, GYRO_SCALE, ALPHA_SMOOTH, MOVEMENT_THRESHOLD, CROP_PADDING, True, "recorded")
+
+
+def pad_batch(entries):
+    """
+    Stack the raw samples of several recordings into (n, longest, 6) values
+    and (n, longest) timestamps, zero padded at the end.
+    """
+    lengths = np.array([len(e["raw"]["samples"]) for e in entries])
+    values = np.zeros((len(entries), lengths.max(initial=0), 6))
+    timestamps = np.zeros(values.shape[:2])
+    for i, entry in enumerate(entries):
+        rows = np.asarray(entry["raw"]["samples"], dtype=np.float64).reshape(-1, 7)
+        timestamps[i, :len(rows)] = rows[:, 0]
+        values[i, :len(rows)] = rows[:, 1:]
+    return values, timestamps, lengths
+
+
+def correct_axes(batch, android):
+    """correctAxes(): on Android y, z = -z, y. android: (n,) bool."""
+    out = batch.copy()
+    out[android, :, 1] = -batch[android, :, 2]
+    out[android, :, 2] = batch[android, :, 1]
+    return out
+
+
+def normalize(batch, accel_scale=ACCEL_SCALE, gyro_scale=GYRO_SCALE):
+    """normalizeSample(). Divides (not multiplies by 1/scale) to match the JS exactly."""
+    out = np.empty_like(batch)
+    out[..., :3] = batch[..., :3] / accel_scale
+    out[..., 3:] = batch[..., 3:] / gyro_scale
+    return out
+
+
+def smooth(batch, alpha=ALPHA_SMOOTH, init=None):
+    """
+    smoothSample(): exponential smoothing along time, same operation order
+    as the JS. Sequential in time but vectorized over recordings and axes.
+    """
+    out = np.empty_like(batch)
+    last = np.zeros(batch.shape[::2]) if init is None else init
+    for t in range(batch.shape[1]):
+        last = alpha * batch[:, t] + (1 - alpha) * last
+        out[:, t] = last
+    return out
+
+
+def preprocess_batch(entries, variant=DEFAULT_VARIANT):
+    """Re-derive the preprocessed samples of recordings that have raw data."""
+    values, timestamps, lengths = pad_batch(entries)
+    if variant.axis_correction:
+        android = np.array([bool(e["raw"].get("android")) for e in entries])
+        values = correct_axes(values, android)
+    values = normalize(values, variant.accel_scale, variant.gyro_scale)
+    init = None
+    if variant.smooth_init == "recorded":
+        init = np.array([e["raw"].get("smooth_init") or [0.0] * 6 for e in entries], dtype=np.float64)
+    values = smooth(values, variant.alpha, init)
+
+    processed = []
+    for i, entry in enumerate(entries):
+        n = lengths[i]
+        if entry["gesture"] == "noise":  # the collector page doesn't crop noise
+            start, end = 0, n - 1
+        else:
+            start, end = crop_bounds(values[i, :n], variant.threshold, variant.padding)
+        samples = [dict(zip(AXES, row), timestamp=t) for row, t in
+                   zip(values[i, start:end + 1].tolist(), timestamps[i, start:end + 1].tolist())]
+        processed.append(dict(entry, samples=samples, preprocessing=variant._asdict()))
+    return processed
+
+
+def preprocess_dataset(entries, variant=DEFAULT_VARIANT, workers=None):
+    """
+    Re-preprocess every recording with raw data, CHUNK_SIZE recordings per
+    task on a pool of worker processes. Returns (processed, skipped count).
+    """
+    with_raw = [e for e in entries if e.get("raw") and e["raw"].get("samples")]
+    chunks = [with_raw[i:i + CHUNK_SIZE] for i in range(0, len(with_raw), CHUNK_SIZE)]
+    if workers == 1 or len(chunks) <= 1:
+        results = [preprocess_batch(chunk, variant) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(preprocess_batch, chunks, [variant] * len(chunks)))
+    return [entry for chunk in results for entry in chunk], len(entries) - len(with_raw)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-derive preprocessed gesture data from the raw samples.")
+    parser.add_argument("input", help="dataset from learning.py")
+    parser.add_argument("-o", "--output", required=True)
+    parser.add_argument("--accel-scale", type=float, default=ACCEL_SCALE)
+    parser.add_argument("--gyro-scale", type=float, default=GYRO_SCALE)
+    parser.add_argument("--alpha", type=float, default=ALPHA_SMOOTH, help="smoothing factor (alphaSmooth)")
+    parser.add_argument("--threshold", type=float, default=MOVEMENT_THRESHOLD, help="crop threshold")
+    parser.add_argument("--padding", type=int, default=CROP_PADDING, help="crop padding in samples")
+    parser.add_argument("--no-axis-correction", action="store_true", help="skip the Android axis swap")
+    parser.add_argument("--smooth-init", choices=["recorded", "zeros"], default="recorded",
+                        help="start smoothing from the phone's state at recording time or from zero")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    variant = Variant(args.accel_scale, args.gyro_scale, args.alpha, args.threshold, args.padding,
+                      not args.no_axis_correction, args.smooth_init)
+    with open(args.input) as f:
+        entries = json.load(f)
+    processed, skipped = preprocess_dataset(entries, variant, args.workers)
+    with open(args.output, "w") as f:
+        json.dump(processed, f)
+    print(f"Preprocessed {len(processed)} recordings into {args.output} ({skipped} without raw data skipped)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+On-demand profiling of a Flask app's request handling.
+
+Start profiling the next N requests and/or T seconds:
+
+    curl -k -X POST -H "X-Admin-Token: $ADMIN_TOKEN" \\
+         "https://host:8080/admin/profile?mode=sample&requests=200&seconds=60"
+
+and fetch the result once it's done:
+
+    curl -k -H "X-Admin-Token: $ADMIN_TOKEN" "https://host:8080/admin/profile?format=collapsed" > out.folded
+
+mode=cprofile (deterministic, one request at a time) gives format=pstats
+(load with pstats / snakeviz) or format=text. mode=sample takes stack samples
+of the request threads and gives format=collapsed (flamegraph.pl /
+speedscope input) or format=text. The endpoints only exist when an admin
+token is configured; while idle the only per-request cost is one attribute
+check. Under gunicorn each worker profiles itself, i.e. whichever worker
+received the admin request.
+"""
+import cProfile
+import hmac
+import io
+import marshal
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, g, jsonify, request
+
+SAMPLE_INTERVAL = 0.005
+MAX_SECONDS = 600
+
+
+def _number_arg(name, convert):
+    """A query argument as a number, None if absent. Raises ValueError if it doesn't parse."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return convert(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number, not {value!r}") from None
+
+
+class RequestProfiler:
+    def __init__(self, app=None, token=None):
+        self.token = token
+        self.lock = threading.Lock()
+        self.active = False
+        self.mode = None
+        self.remaining = None
+        self.deadline = None
+        self.stats = None  # pstats.Stats for cprofile mode
+        self.samples = Counter()  # collapsed stack -> count for sample mode
+        self.request_threads = set()
+        self.cprofile_busy = threading.Lock()
+        self.profiled_requests = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not self.token:
+            return
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        app.add_url_rule("/admin/profile", "admin_profile", self._endpoint, methods=["GET", "POST"])
+
+    # --- control -------------------------------------------------------
+
+    def start(self, mode, requests=None, seconds=None):
+        if mode not in ("cprofile", "sample"):
+            raise ValueError("mode must be cprofile or sample")
+        if requests is not None and requests <= 0:
+            raise ValueError("requests must be positive")
+        if seconds is not None and not 0 < seconds < float("inf"):
+            raise ValueError("seconds must be positive")
+        with self.lock:
+            if self.active:
+                raise RuntimeError("profiling already running")
+            self.mode = mode
+            self.remaining = requests
+            self.deadline = time.monotonic() + min(seconds or MAX_SECONDS, MAX_SECONDS)
+            self.stats = None
+            self.samples = Counter()
+            self.profiled_requests = 0
+            self.active = True
+        if mode == "sample":
+            threading.Thread(target=self._sampler, daemon=True, name="profiler").start()
+
+    def _finish_if_done(self):
+        if (self.remaining is not None and self.remaining <= 0) or time.monotonic() >= self.deadline:
+            self.active = False
+
+    # --- request hooks -------------------------------------------------
+
+    def _before_request(self):
+        if not self.active or request.endpoint == "admin_profile":
+            return
+        if self.mode == "sample":
+            self.request_threads.add(threading.get_ident())
+            g._profiling = True
+        elif self.cprofile_busy.acquire(blocking=False):
+            # cProfile can't run in several threads at once on newer Pythons,
+            # so concurrent requests simply aren't profiled.
+            g._profiler = cProfile.Profile()
+            g._profiler.enable()
+
+    def _teardown_request(self, exc):
+        profiler = g.pop("_profiler", None)
+        sampled = g.pop("_profiling", False)
+        if profiler is None and not sampled:
+            return
+        if profiler is not None:
+            profiler.disable()
+            self.cprofile_busy.release()
+        else:
+            self.request_threads.discard(threading.get_ident())
+        with self.lock:
+            if profiler is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profiler)
+                else:
+                    self.stats.add(profiler)
+            self.profiled_requests += 1
+            if self.remaining is not None:
+                self.remaining -= 1
+            self._finish_if_done()
+
+    def _sampler(self):
+        me = threading.get_ident()
+        while self.active:
+            frames = sys._current_frames()
+            for ident in list(self.request_threads):
+                frame = frames.get(ident)
+                if frame is None or ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(SAMPLE_INTERVAL)
+            with self.lock:
+                self._finish_if_done()
+
+    # --- results -------------------------------------------------------
+
+    def result(self, fmt):
+        """Returns (body, mimetype, filename)."""
+        if self.mode == "cprofile":
+            if self.stats is None:
+                raise LookupError("no requests were profiled")
+            if fmt == "pstats":
+                return marshal.dumps(self.stats.stats), "application/octet-stream", "profile.pstats"
+            if fmt == "text":
+                out = io.StringIO()
+                stats = pstats.Stats(stream=out)
+                stats.add(self.stats)
+                stats.sort_stats("cumulative").print_stats(60)
+                return out.getvalue(), "text/plain", "profile.txt"
+        elif self.mode == "sample":
+            if not self.samples:
+                raise LookupError("no samples were taken")
+            if fmt == "collapsed":
+                body = "".join(f"{stack} {count}\n" for stack, count in self.samples.items())
+                return body, "text/plain", "profile.folded"
+            if fmt == "text":
+                leaves = Counter()
+                for stack, count in self.samples.items():
+                    leaves[stack.rsplit(";", 1)[-1]] += count
+                total = sum(leaves.values())
+                body = "".join(f"{100 * n / total:6.2f}%  {n:6d}  {frame}\n" for frame, n in leaves.most_common(60))
+                return body, "text/plain", "profile.txt"
+        else:
+            raise LookupError("profiling was never started")
+        raise ValueError(f"format {fmt!r} is not available for mode {self.mode}")
+
+    def _endpoint(self):
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), self.token):
+            return jsonify({"error": "forbidden"}), 403
+
+        if request.method == "POST":
+            try:
+                self.start(request.args.get("mode", "sample"),
+                           _number_arg("requests", int),
+                           _number_arg("seconds", float))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            except RuntimeError as e:
+                return jsonify({"error": str(e)}), 409
+            return jsonify({"started": self.mode, "requests": self.remaining}), 202
+
+        with self.lock:
+            if self.active:
+                self._finish_if_done()
+        if self.active:
+            return jsonify({"running": self.mode, "profiled_requests": self.profiled_requests,
+                            "remaining_requests": self.remaining}), 202
+        try:
+            body, mimetype, filename = self.result(request.args.get("format", "text"))
+        except (LookupError, ValueError) as e:
+            return jsonify({"error": str(e)}), 404 if isinstance(e, LookupError) else 400
+        return Response(body, mimetype=mimetype,
+                        headers={"Content-Disposition": f"attachment; filename={filename}"})
+
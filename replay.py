@@ -0,0 +1,122 @@
+"""
+Replay recorded sessions (see session_recorder.py) through the server side
+pipeline: the page's endpointing (gesture_pipeline.py) and the server's
+classify(), at N times real time.
+
+    python replay.py sessions/*.gsr --speed 50 --out run.json
+    python replay.py sessions/*.gsr --speed 0 --baseline run.json
+
+--speed 0 replays as fast as possible. Detections are compared against the
+predictions the live server logged during the session and, with --baseline,
+against an earlier replay (e.g. before a segmentation or model change).
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from gesture_pipeline import AXES, GestureSegmenter
+from session_recorder import read_session, read_events
+
+MATCH_TOLERANCE_MS = 300  # detections this close in time are the same gesture
+
+
+def replay_session(path, classify, speed):
+    header, records = read_session(path)
+    segmenter = GestureSegmenter(android=header.get("android", False))
+    raw = np.stack([records[axis] for axis in AXES], axis=1).astype(np.float64)
+    timestamps = records["t"]
+
+    detections = []
+    wall_start = time.perf_counter()
+    for t, sample in zip(timestamps, raw.tolist()):
+        if speed > 0:
+            ahead = (t - timestamps[0]) / 1000 / speed - (time.perf_counter() - wall_start)
+            if ahead > 0:
+                time.sleep(ahead)
+        window = segmenter.push(t, sample)
+        if window is None:
+            continue
+        begin = time.perf_counter()
+        label, probs = classify(window)
+        latency_ms = (time.perf_counter() - begin) * 1000
+        if label != "noise":
+            segmenter.pause(t)
+        detections.append({"t": float(t), "label": str(label),
+                           "confidence": float(np.max(probs)), "latency_ms": latency_ms})
+
+    duration_s = (timestamps[-1] - timestamps[0]) / 1000 if len(timestamps) else 0.0
+    return {"session": path, "samples": len(records), "duration_s": duration_s,
+            "replay_s": time.perf_counter() - wall_start, "detections": detections}
+
+
+def agreement(detections, reference):
+    """
+    Fraction of reference gestures that were detected at about the same time
+    with the same label, plus the number of unmatched extra detections.
+    """
+    detections = [d for d in detections if d["label"] != "noise"]
+    reference = [r for r in reference if r.get("label") != "noise" and r.get("t") is not None]
+    if not reference:
+        return None, len(detections)
+    unused = list(detections)
+    matched = 0
+    for ref in reference:
+        near = [d for d in unused if abs(d["t"] - ref["t"]) <= MATCH_TOLERANCE_MS]
+        if not near:
+            continue
+        best = min(near, key=lambda d: abs(d["t"] - ref["t"]))
+        unused.remove(best)
+        matched += best["label"] == ref["label"]
+    return matched / len(reference), len(unused)
+
+
+def summarize(result, references):
+    detections = result["detections"]
+    labels = {}
+    for d in detections:
+        labels[d["label"]] = labels.get(d["label"], 0) + 1
+    line = (f"{result['session']}: {result['duration_s']:.0f}s of motion replayed in {result['replay_s']:.1f}s, "
+            f"{len(detections)} detections {labels}")
+    if detections:
+        lat = np.array([d["latency_ms"] for d in detections])
+        line += f"\n  classify latency ms: p50={np.percentile(lat, 50):.2f} p95={np.percentile(lat, 95):.2f} max={lat.max():.2f}"
+    for name, reference in references:
+        score, extra = agreement(detections, reference)
+        if score is not None:
+            line += f"\n  agreement with {name}: {score:.1%}, {extra} extra detections"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded motion sessions through the detection pipeline.")
+    parser.add_argument("sessions", nargs="+", help=".gsr session files")
+    parser.add_argument("--speed", type=float, default=10.0, help="multiple of real time, 0 = unthrottled")
+    parser.add_argument("--out", help="write detections to this JSON file")
+    parser.add_argument("--baseline", help="detections JSON of an earlier replay to compare against")
+    args = parser.parse_args()
+
+    # imported late, loading the model takes a while
+    from detection_server_preproc import classify
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {r["session"]: r["detections"] for r in json.load(f)}
+
+    results = []
+    for path in args.sessions:
+        result = replay_session(path, classify, args.speed)
+        summarize(result, [("live predictions", read_events(path)),
+                           ("baseline", baseline.get(path, []))])
+        results.append(result)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Detections saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
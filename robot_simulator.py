@@ -0,0 +1,132 @@
+"""
+Simulated robot for testing the command path without hardware.
+
+Run a fake robot that acks every command over TCP and UDP:
+
+    python robot_simulator.py --tcp 9000 --udp 9001 --delay-ms 5
+
+then point the detection server at it with
+ROBOT_URLS="sim=tcp://127.0.0.1:9000", or measure command-to-ack latency
+through the same transport code the server uses:
+
+    python robot_simulator.py --bench tcp://127.0.0.1:9000 udp://127.0.0.1:9001 --count 500
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from robot_transport import RobotPool
+
+
+class RobotState:
+    def __init__(self, delay_ms, verbose):
+        self.delay = delay_ms / 1000
+        self.verbose = verbose
+        self.executed = 0
+
+    def execute(self, line):
+        seq, _, command = line.strip().partition(" ")
+        if not seq:
+            return None
+        if self.delay:
+            time.sleep(self.delay)  # pretend to drive the motors
+        self.executed += 1
+        if self.verbose:
+            print(f"executing {command!r} (#{seq})")
+        return f"{seq} ok\n".encode("ascii")
+
+
+class TcpHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for raw in self.rfile:
+            reply = self.server.robot.execute(raw.decode("ascii", "replace"))
+            if reply:
+                self.wfile.write(reply)
+                self.wfile.flush()
+
+
+class UdpHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, sock = self.request
+        reply = self.server.robot.execute(data.decode("ascii", "replace"))
+        if reply:
+            sock.sendto(reply, self.client_address)
+
+
+class TcpServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class UdpServer(socketserver.ThreadingUDPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def run_robot(args):
+    robot = RobotState(args.delay_ms, args.verbose)
+    servers = []
+    if args.tcp:
+        servers.append(TcpServer((args.host, args.tcp), TcpHandler))
+    if args.udp:
+        servers.append(UdpServer((args.host, args.udp), UdpHandler))
+    for server in servers:
+        server.robot = robot
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Simulated robot listening on {args.host} (tcp={args.tcp}, udp={args.udp}, delay={args.delay_ms}ms)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"Executed {robot.executed} commands")
+
+
+def run_bench(args):
+    pool = RobotPool({f"robot{i}": url for i, url in enumerate(args.bench)}, pool_size=args.pool_size)
+    pool.connect()
+
+    latencies = []
+    failures = 0
+    start = time.perf_counter()
+    for i in range(args.count):
+        # one gesture -> the command fans out to every robot at once
+        begin = time.perf_counter()
+        results = pool.send(args.command)
+        latencies.append((time.perf_counter() - begin) * 1000)
+        failures += sum(not r.ok for r in results)
+    elapsed = time.perf_counter() - start
+    pool.close()
+
+    lat = np.array(latencies)
+    print(f"{args.count} commands to {len(args.bench)} robot(s) in {elapsed:.2f}s, {failures} failed")
+    print("command-to-ack latency (ms): "
+          f"p50={np.percentile(lat, 50):.3f} p95={np.percentile(lat, 95):.3f} "
+          f"p99={np.percentile(lat, 99):.3f} max={lat.max():.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated robot / transport latency benchmark.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--tcp", type=int, help="TCP port to listen on")
+    parser.add_argument("--udp", type=int, help="UDP port to listen on")
+    parser.add_argument("--delay-ms", type=float, default=0.0, help="simulated execution time per command")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--bench", nargs="+", metavar="URL", help="benchmark these robot URLs instead")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--command", default="noop")
+    parser.add_argument("--pool-size", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.bench:
+        run_bench(args)
+    elif args.tcp or args.udp:
+        run_robot(args)
+    else:
+        parser.error("give --tcp/--udp to run a robot or --bench URL to measure one")
+
+
+if __name__ == "__main__":
+    main()
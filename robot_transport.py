@@ -0,0 +1,278 @@
+"""
+Robot transports with persistent, pooled connections.
+
+Robots are addressed by URL:
+
+    tcp://192.168.1.50:9000
+    udp://192.168.1.50:9001
+    serial:///dev/ttyUSB0?baud=115200
+
+Every command goes out as one text line "<seq> <command>\\n" and the robot
+answers "<seq> ok\\n" (or "<seq> err <reason>\\n") once it has executed it.
+Connections are opened up front by RobotPool.connect() and reused for every
+command, so connection setup never lands on the gesture path.
+"""
+import itertools
+import queue
+import socket
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+
+ACK_TIMEOUT = 1.0  # seconds to wait for the robot to acknowledge a command
+CONNECT_TIMEOUT = 3.0
+DEFAULT_POOL_SIZE = 2
+
+CommandResult = namedtuple("CommandResult", ["robot", "command", "ok", "latency_ms", "error"])
+
+
+class TransportError(Exception):
+    pass
+
+
+def parse_ack(line, seq):
+    """
+    Parse one reply line. Returns None for replies to other (older) commands,
+    otherwise (ok, error).
+    """
+    parts = line.strip().split(" ", 2)
+    if not parts or parts[0] != str(seq):
+        return None
+    if len(parts) > 1 and parts[1] == "ok":
+        return True, None
+    return False, parts[2] if len(parts) > 2 else "robot rejected command"
+
+
+class TcpConnection:
+    def __init__(self, host, port):
+        self.sock = socket.create_connection((host, port), timeout=CONNECT_TIMEOUT)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.reader = self.sock.makefile("r", encoding="ascii", newline="\n")
+
+    def request(self, seq, command, timeout):
+        self.sock.settimeout(timeout)
+        self.sock.sendall(f"{seq} {command}\n".encode("ascii"))
+        deadline = time.monotonic() + timeout
+        while True:
+            line = self.reader.readline()
+            if not line:
+                raise TransportError("connection closed by robot")
+            ack = parse_ack(line, seq)
+            if ack is not None:
+                return ack
+            # a late ack for a command that already timed out, skip it
+            self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class UdpConnection:
+    def __init__(self, host, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((host, port))
+
+    def request(self, seq, command, timeout):
+        self.sock.settimeout(timeout)
+        self.sock.send(f"{seq} {command}\n".encode("ascii"))
+        deadline = time.monotonic() + timeout
+        while True:
+            ack = parse_ack(self.sock.recv(512).decode("ascii", "replace"), seq)
+            if ack is not None:
+                return ack
+            self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+
+    def close(self):
+        self.sock.close()
+
+
+class SerialConnection:
+    def __init__(self, port, baudrate):
+        try:
+            import serial
+        except ImportError:
+            raise TransportError("serial robots need pyserial (pip install pyserial)")
+        self.port = serial.Serial(port, baudrate=baudrate, timeout=ACK_TIMEOUT)
+
+    def request(self, seq, command, timeout):
+        self.port.timeout = timeout
+        self.port.write(f"{seq} {command}\n".encode("ascii"))
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = self.port.readline().decode("ascii", "replace")
+            if not line:
+                break
+            ack = parse_ack(line, seq)
+            if ack is not None:
+                return ack
+        raise socket.timeout("no ack from robot")
+
+    def close(self):
+        self.port.close()
+
+
+def open_connection(url):
+    parsed = urlparse(url)
+    if parsed.scheme == "tcp":
+        return TcpConnection(parsed.hostname, parsed.port)
+    if parsed.scheme == "udp":
+        return UdpConnection(parsed.hostname, parsed.port)
+    if parsed.scheme == "serial":
+        baud = int(parse_qs(parsed.query).get("baud", ["115200"])[0])
+        return SerialConnection(parsed.path, baud)
+    raise TransportError(f"unsupported robot URL: {url}")
+
+
+class RobotLink:
+    """
+    A small pool of open connections to one robot. A serial port can only be
+    opened once, so serial robots always get a pool of one.
+    """
+
+    def __init__(self, name, url, pool_size=DEFAULT_POOL_SIZE):
+        self.name = name
+        self.url = url
+        self.pool_size = 1 if url.startswith("serial:") else pool_size
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.open_count = 0  # open or currently connecting
+        self.established = 0
+        self.seq = itertools.count(1)
+        self.last_latency_ms = None
+        self.last_error = None
+
+    @property
+    def connected(self):
+        return self.established > 0
+
+    def connect(self):
+        """Open the whole pool. Failures are remembered, not raised."""
+        for _ in range(self.pool_size):
+            if not self._open_one():
+                break
+
+    def _open_one(self):
+        with self.lock:
+            if self.open_count >= self.pool_size:
+                return False
+            self.open_count += 1
+        try:
+            conn = open_connection(self.url)
+        except Exception as e:
+            with self.lock:
+                self.open_count -= 1
+            self.last_error = str(e)
+            return False
+        with self.lock:
+            self.established += 1
+        self.idle.put(conn)
+        return True
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.lock:
+            self.open_count -= 1
+            self.established -= 1
+        self._reconnect_async()
+
+    def _reconnect_async(self):
+        # Reopen in the background so gestures never wait for a handshake.
+        threading.Thread(target=self.connect, daemon=True).start()
+
+    def send(self, command, timeout=ACK_TIMEOUT):
+        start = time.perf_counter()
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            # Every pooled connection is busy with another command, being
+            # reopened, or the robot is unreachable.
+            if self.open_count < self.pool_size:
+                self._reconnect_async()
+            if not self.connected:
+                self.last_error = "not connected"
+                return CommandResult(self.name, command, False, None, self.last_error)
+            try:
+                conn = self.idle.get(timeout=timeout)
+            except queue.Empty:
+                self.last_error = "no free connection"
+                return CommandResult(self.name, command, False, None, self.last_error)
+
+        seq = next(self.seq)
+        try:
+            ok, error = conn.request(seq, command, timeout)
+        except (OSError, TransportError) as e:
+            self._discard(conn)
+            self.last_error = str(e) or e.__class__.__name__
+            return CommandResult(self.name, command, False, None, self.last_error)
+        self.idle.put(conn)
+
+        latency_ms = (time.perf_counter() - start) * 1000
+        self.last_latency_ms = latency_ms
+        self.last_error = error
+        return CommandResult(self.name, command, ok, latency_ms, error)
+
+    def status(self):
+        return {"robot": self.name, "connected": self.connected,
+                "last_latency_ms": self.last_latency_ms, "last_error": self.last_error}
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self.open_count = self.established = 0
+
+
+class RobotPool:
+    """
+    All configured robots. send() fans a command out to several robots in
+    parallel and returns once every one of them acked or timed out.
+    """
+
+    def __init__(self, robots, pool_size=DEFAULT_POOL_SIZE):
+        self.links = {name: RobotLink(name, url, pool_size) for name, url in robots.items()}
+        self.executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.links)),
+                                           thread_name_prefix="robot")
+
+    def connect(self):
+        list(self.executor.map(RobotLink.connect, self.links.values()))
+
+    def send(self, command, targets=None, timeout=ACK_TIMEOUT):
+        """One CommandResult per target, in order; robots that aren't configured fail with "unknown robot"."""
+        names = list(targets) if targets else list(self.links)
+        links = [self.links[name] for name in names if name in self.links]
+        if len(links) == 1:
+            sent = {links[0].name: links[0].send(command, timeout)}
+        else:
+            futures = {link.name: self.executor.submit(link.send, command, timeout) for link in links}
+            sent = {name: f.result() for name, f in futures.items()}
+        return [sent.get(name) or CommandResult(name, command, False, None, "unknown robot") for name in names]
+
+    def status(self):
+        return [link.status() for link in self.links.values()]
+
+    def close(self):
+        for link in self.links.values():
+            link.close()
+        self.executor.shutdown(wait=False)
+
+
+def parse_robot_urls(spec):
+    """
+    "rover=tcp://10.0.0.5:9000,arm=udp://10.0.0.6:9001" -> {"rover": ..., "arm": ...}
+    """
+    robots = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, url = item.partition("=")
+        if not url:
+            raise ValueError(f"expected name=url, got {item!r}")
+        robots[name.strip()] = url.strip()
+    return robots
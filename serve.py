@@ -0,0 +1,126 @@
+"""
+Production launcher for the detection server.
+
+    python serve.py [--workers 1] [--threads 16]
+
+Runs detection_server_preproc:app under gunicorn with threaded workers,
+HTTP keep-alive and TLS using a certificate that is generated once and then
+reused, so phones don't have to re-accept a new self signed certificate after
+every restart. SIGTERM / Ctrl+C stops accepting new connections and lets the
+in-flight predictions finish (up to --graceful-timeout seconds).
+"""
+import argparse
+import os
+import ssl
+
+from gunicorn.app.base import BaseApplication
+from werkzeug.serving import make_ssl_devcert
+
+import thread_config
+
+APP_MODULE = "detection_server_preproc"
+CERT_BASE = os.path.join("certs", "server")  # -> certs/server.crt, certs/server.key
+DEFAULT_PORT = 8080
+
+_ssl_contexts = {}
+
+
+def ensure_certificate(base_path):
+    """
+    Create a self signed certificate at base_path.crt / base_path.key
+    unless one already exists. Returns (certfile, keyfile).
+    """
+    certfile, keyfile = base_path + ".crt", base_path + ".key"
+    if not (os.path.exists(certfile) and os.path.exists(keyfile)):
+        os.makedirs(os.path.dirname(base_path) or ".", exist_ok=True)
+        make_ssl_devcert(base_path, host="*")
+        print(f"Generated self signed certificate {certfile}")
+    return certfile, keyfile
+
+
+def ssl_context(conf, default_ssl_context_factory):
+    """
+    gunicorn builds a fresh SSLContext for every accepted connection, which
+    throws away the session cache and ticket keys. Keep one context per
+    worker process so reconnecting clients can resume their TLS session.
+    """
+    pid = os.getpid()
+    context = _ssl_contexts.get(pid)
+    if context is None:
+        context = default_ssl_context_factory()
+        context.options &= ~ssl.OP_NO_TICKET
+        _ssl_contexts[pid] = context
+    return context
+
+
+def worker_exit(server, worker):
+    server.log.info("Worker %s drained and exited", worker.pid)
+
+
+class GestureServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Imported here so every worker loads its own copy of the model
+        # (TensorFlow doesn't survive being forked after initialisation).
+        module = __import__(APP_MODULE)
+        return module.app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the gesture detection server in production mode.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=thread_config.tuned_workers() or 1,
+                        help="worker processes, each with its own model (default: the number autotune.py "
+                             "tuned for, else 1); keep 1 for keyboard overrides, acks and admission limits")
+    parser.add_argument("--threads", type=int, default=16,
+                        help="request threads per worker, open pages' streams may use all but 4 of them")
+    parser.add_argument("--keepalive", type=int, default=75, help="seconds to keep idle connections open")
+    parser.add_argument("--timeout", type=int, default=30, help="kill workers stuck for this many seconds")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="seconds to let in-flight requests finish on shutdown")
+    parser.add_argument("--certfile", help="TLS certificate (default: generated in certs/)")
+    parser.add_argument("--keyfile", help="TLS private key (default: generated in certs/)")
+    parser.add_argument("--no-tls", action="store_true", help="serve plain HTTP, e.g. behind a TLS proxy")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.workers > 1:
+        print(f"Warning: {args.workers} workers. Keyboard overrides, command acks and admission limits are "
+              f"kept per worker process and only work reliably with --workers 1 (raise --threads instead).")
+    # workers read this to share the cores if --workers differs from the tuned value
+    os.environ[thread_config.WORKERS_VARIABLE] = str(args.workers)
+    # the server keeps some threads free of /events and /control streams
+    os.environ["GESTURE_THREADS"] = str(args.threads)
+    options = {
+        "bind": f"{args.host}:{args.port}",
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "keepalive": args.keepalive,
+        "timeout": args.timeout,
+        "graceful_timeout": args.graceful_timeout,
+        "preload_app": False,
+        "worker_exit": worker_exit,
+    }
+    if not args.no_tls:
+        if args.certfile and args.keyfile:
+            certfile, keyfile = args.certfile, args.keyfile
+        else:
+            certfile, keyfile = ensure_certificate(CERT_BASE)
+        options.update({"certfile": certfile, "keyfile": keyfile, "ssl_context": ssl_context})
+
+    GestureServer(options).run()
+
+
+if __name__ == "__main__":
+    main()
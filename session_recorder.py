@@ -0,0 +1,113 @@
+"""
+Compact on-disk format for raw devicemotion sessions.
+
+A session file (sessions/<id>.gsr) is
+
+    b"GSR1" | uint32 header length | JSON header | records...
+
+where every record is 32 bytes: a little-endian float64 timestamp (epoch ms)
+followed by float32 x, y, z, alpha, beta, gamma exactly as devicemotion
+reported them (before correctAxes / normalisation). The detection page packs
+records in this layout itself, so the server only validates and appends.
+
+Predictions the live server made during the session go to a sidecar
+sessions/<id>.events.jsonl so replays can be compared against them.
+
+Recording needs no login, so the disk use is bounded: at most
+MAX_APPEND_BYTES per request, MAX_SESSION_BYTES per session and no new
+sessions once SESSION_DIR holds MAX_TOTAL_BYTES.
+"""
+import json
+import os
+import re
+import struct
+import time
+import uuid
+
+import numpy as np
+
+SESSION_DIR = "sessions"
+MAGIC = b"GSR1"
+RECORD_DTYPE = np.dtype([("t", "<f8"), ("x", "<f4"), ("y", "<f4"), ("z", "<f4"),
+                         ("alpha", "<f4"), ("beta", "<f4"), ("gamma", "<f4")])
+RECORD_SIZE = RECORD_DTYPE.itemsize
+
+MAX_APPEND_BYTES = 256 * 1024  # the page sends about 2 KB a second
+MAX_SESSION_BYTES = 64 * 1024 * 1024  # hours of recording
+MAX_TOTAL_BYTES = 2 * 1024 * 1024 * 1024
+
+_SESSION_ID = re.compile(r"^[0-9a-zA-Z_-]{1,64}$")
+
+
+def session_path(session_id, suffix=".gsr"):
+    if not _SESSION_ID.match(session_id):
+        raise ValueError("invalid session id")
+    return os.path.join(SESSION_DIR, session_id + suffix)
+
+
+class SessionFull(Exception):
+    """A session or the session directory reached its size limit."""
+
+
+def sessions_size():
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(SESSION_DIR) if entry.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+def start_session(meta):
+    """Create a new session file with the given metadata, returns its id."""
+    if sessions_size() >= MAX_TOTAL_BYTES:
+        raise SessionFull(f"{SESSION_DIR}/ is full")
+    session_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
+    header = json.dumps(dict(meta, started_at=time.time(), format="t:f8,xyz:f4,rot:f4")).encode("utf-8")
+    os.makedirs(SESSION_DIR, exist_ok=True)
+    with open(session_path(session_id), "xb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+    return session_id
+
+
+def append_records(session_id, payload):
+    """
+    Append packed records to a session. Appends are single O_APPEND writes,
+    so several server workers can record into the same session.
+    """
+    if len(payload) % RECORD_SIZE:
+        raise ValueError(f"payload is not a multiple of {RECORD_SIZE} bytes")
+    if len(payload) > MAX_APPEND_BYTES:
+        raise SessionFull(f"at most {MAX_APPEND_BYTES} bytes per request")
+    path = session_path(session_id)
+    if not os.path.exists(path):
+        raise FileNotFoundError(session_id)
+    if os.path.getsize(path) + len(payload) > MAX_SESSION_BYTES:
+        raise SessionFull("session reached its size limit")
+    with open(path, "ab") as f:
+        f.write(payload)
+    return len(payload) // RECORD_SIZE
+
+
+def log_event(session_id, event):
+    with open(session_path(session_id, ".events.jsonl"), "a") as f:
+        f.write(json.dumps(event) + "\n")
+
+
+def read_session(path):
+    """Returns (header dict, structured array of records)."""
+    with open(path, "rb") as f:
+        if f.read(4) != MAGIC:
+            raise ValueError(f"{path} is not a session recording")
+        (length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length))
+        data = f.read()
+    # drop a trailing partial record left by an interrupted write
+    usable = len(data) - len(data) % RECORD_SIZE
+    return header, np.frombuffer(data[:usable], dtype=RECORD_DTYPE)
+
+
+def read_events(path):
+    events_path = path[:-len(".gsr")] + ".events.jsonl"
+    if not os.path.exists(events_path):
+        return []
+    with open(events_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
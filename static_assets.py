@@ -0,0 +1,181 @@
+"""
+Pages and model files served as precompressed, cacheable static assets,
+plus a service worker that keeps them on the phone.
+
+Everything is read, rendered and gzip-compressed once at startup:
+
+- pages keep their URL (/, /keyboard, ...) and are sent with
+  "Cache-Control: no-cache" and an ETag, so a reload costs one 304
+- files (static/tf.min.js, the tfjs_model/ shards, ...) get URLs with their
+  content hash, /assets/<hash>/<name>, and are cached for a year; a new
+  model gets new URLs, so nothing stale is ever used
+- /sw.js precaches the pages (and the files added with precache=True) when
+  a page is first opened and answers later requests for them from the
+  cache, so reloading is instant and works without the internet or even the
+  server; its version is the hash of what it precaches, so any change is
+  picked up in the background on the next visit. Other files are only
+  fetched by a page that uses them, and then kept by the browser's cache
+
+Pages get a window.ASSETS map from file name to hashed URL, e.g.
+tf.loadLayersModel(ASSETS["tfjs_model/model.json"]). Service workers only
+run on HTTPS (or localhost).
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import Response, abort, request
+
+ASSET_PREFIX = "/assets"
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+HASH_LENGTH = 12
+MIN_GZIP_SIZE = 256  # below this the headers cost more than compression saves
+
+SERVICE_WORKER = """
+const CACHE = "__CACHE__";
+const PRECACHE = __PRECACHE__;
+
+self.addEventListener("install", event => {
+    event.waitUntil(caches.open(CACHE).then(cache => cache.addAll(PRECACHE)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener("activate", event => {
+    event.waitUntil(caches.keys()
+        .then(keys => Promise.all(keys.filter(k => k !== CACHE).map(k => caches.delete(k))))
+        .then(() => self.clients.claim()));
+});
+
+self.addEventListener("fetch", event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== "GET" || url.origin !== location.origin || !PRECACHE.includes(url.pathname)) return;
+    // Query strings (?operator=, ?password=) are read by the page itself.
+    event.respondWith(caches.open(CACHE)
+        .then(cache => cache.match(url.pathname))
+        .then(cached => cached || fetch(event.request)));
+});
+"""
+
+REGISTER_SCRIPT = """
+<script>
+window.ASSETS = __ASSETS__;
+if ("serviceWorker" in navigator) {
+    navigator.serviceWorker.register("/sw.js").catch(err => console.log("service worker not installed:", err));
+}
+</script>
+"""
+
+
+class Asset:
+    def __init__(self, body, mimetype, cache_control):
+        self.body = body
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.hash = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+        compressed = gzip.compress(body, compresslevel=9, mtime=0) if len(body) >= MIN_GZIP_SIZE else None
+        self.gzip_body = compressed if compressed is not None and len(compressed) < len(body) else None
+
+    def response(self):
+        gzipped = self.gzip_body is not None and request.accept_encodings["gzip"] > 0
+        etag = self.hash + ("-gz" if gzipped else "")
+        if request.if_none_match.contains(self.hash) or request.if_none_match.contains(self.hash + "-gz"):
+            response = Response(status=304)
+        else:
+            response = Response(self.gzip_body if gzipped else self.body, mimetype=self.mimetype)
+            if gzipped:
+                response.headers["Content-Encoding"] = "gzip"
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = self.cache_control
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+
+class StaticAssets:
+    """
+    Add files and directories first, then pages (they embed the files' URLs),
+    then call install() to register /assets/ and /sw.js on the app.
+    """
+
+    def __init__(self, app, name):
+        self.app = app
+        self.name = name
+        self.files = {}  # hashed URL -> Asset
+        self.urls = {}  # file name -> hashed URL
+        self.pages = {}  # route -> Asset
+        self.precache = []  # hashed URLs of files the service worker fetches up front
+
+    def add_file(self, path, name=None, precache=False):
+        """Serve a file under its content hash. Missing files are skipped, returns the URL or None."""
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            asset = self._asset(f.read(), path)
+        name = name or os.path.basename(path)
+        url = f"{ASSET_PREFIX}/{asset.hash}/{name}"
+        self.files[url] = asset
+        self.urls[name] = url
+        if precache:
+            self.precache.append(url)
+        return url
+
+    def add_dir(self, directory, precache=False):
+        """
+        Serve a directory under one hash of all its files, so relative
+        references between them (model.json -> weight shards) keep working.
+        """
+        if not os.path.isdir(directory):
+            return None
+        names = sorted(n for n in os.listdir(directory) if os.path.isfile(os.path.join(directory, n)))
+        contents = {}
+        digest = hashlib.sha256()
+        for n in names:
+            with open(os.path.join(directory, n), "rb") as f:
+                contents[n] = f.read()
+            digest.update(n.encode() + b"\0" + hashlib.sha256(contents[n]).digest())
+        base = f"{ASSET_PREFIX}/{digest.hexdigest()[:HASH_LENGTH]}/{os.path.basename(directory.rstrip(os.sep))}"
+        for n in names:
+            url = f"{base}/{n}"
+            self.files[url] = self._asset(contents[n], n)
+            self.urls[f"{os.path.basename(directory.rstrip(os.sep))}/{n}"] = url
+            if precache:
+                self.precache.append(url)
+        return base
+
+    def add_page(self, route, html):
+        """Render a page template once, with the service worker registration and ASSETS map added."""
+        html = self.app.jinja_env.from_string(html).render()
+        script = REGISTER_SCRIPT.replace("__ASSETS__", json.dumps(self.urls))
+        html = html.replace("</body>", script + "</body>", 1) if "</body>" in html else html + script
+        self.pages[route] = Asset(html.encode("utf-8"), "text/html", REVALIDATE)
+
+    def page(self, route):
+        return self.pages[route].response()
+
+    def _asset(self, body, name):
+        mimetype = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        return Asset(body, mimetype, IMMUTABLE)
+
+    def version(self):
+        digest = hashlib.sha256()
+        for key in sorted(list(self.pages) + self.precache):
+            digest.update(key.encode() + (self.pages.get(key) or self.files[key]).hash.encode())
+        return digest.hexdigest()[:HASH_LENGTH]
+
+    def install(self):
+        precache = list(self.pages) + self.precache
+        self.service_worker = Asset(
+            SERVICE_WORKER.replace("__CACHE__", f"{self.name}-{self.version()}")
+                          .replace("__PRECACHE__", json.dumps(precache)).encode("utf-8"),
+            "text/javascript", REVALIDATE)
+        self.app.add_url_rule(f"{ASSET_PREFIX}/<path:path>", "static_asset", self._serve_file)
+        self.app.add_url_rule("/sw.js", "service_worker", self.service_worker.response)
+        print(f"Serving {len(self.pages)} pages and {len(self.files)} cached assets "
+              f"({len(self.precache)} precached), version {self.version()}")
+
+    def _serve_file(self, path):
+        asset = self.files.get(f"{ASSET_PREFIX}/{path}")
+        if asset is None:
+            abort(404)
+        return asset.response()
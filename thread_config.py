@@ -0,0 +1,88 @@
+"""
+Thread pool sizes for TensorFlow and the BLAS libraries behind numpy.
+
+By default every process sizes its pools for the whole machine, so several
+server workers oversubscribe the cores, and a batch-1 prediction gains
+nothing from a big pool anyway. `python autotune.py` measures what works
+best on this machine and writes thread_config.json; the detection server
+and model_training.py call apply() first thing, before numpy or TensorFlow
+start their pools. The thread counts are tuned for a number of server
+workers (1 by default), which is also the number serve.py starts unless
+told otherwise; it passes the number it actually starts, and a different
+one gets an even share of the cores per worker instead.
+
+    {"serving": {"workers": 1, "intra_op": 4, "inter_op": 1, "blas": 1},
+     "training": {"intra_op": 4, "inter_op": 2, "blas": 4}, ...}
+
+Without the file nothing is changed. Variables already set in the
+environment (OMP_NUM_THREADS, TF_NUM_INTRAOP_THREADS, ...) always win.
+THREAD_CONFIG points to another file.
+"""
+import json
+import os
+import sys
+
+THREAD_CONFIG_FILE = "thread_config.json"
+BLAS_VARIABLES = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+WORKERS_VARIABLE = "GESTURE_WORKERS"  # set by serve.py, the number of worker processes actually started
+
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def load(path=None):
+    path = path or os.environ.get("THREAD_CONFIG", THREAD_CONFIG_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        print(f"ignoring {path}: {e}")
+        return None
+
+
+def settings(role, config=None):
+    """The thread counts for "serving" or "training", or None if there is no config for it."""
+    config = load() if config is None else config
+    if not config or role not in config:
+        return None
+    chosen = dict(config[role])
+    workers = os.environ.get(WORKERS_VARIABLE)
+    if role == "serving" and workers and int(workers) != chosen.get("workers"):
+        # Tuned for another number of workers: share the cores out evenly instead.
+        chosen["workers"] = int(workers)
+        chosen["intra_op"] = max(1, cpu_count() // int(workers))
+    return chosen
+
+
+def tuned_workers(config=None):
+    """The number of server workers the serving threads were tuned for, or None."""
+    config = load() if config is None else config
+    return ((config or {}).get("serving") or {}).get("workers")
+
+
+def apply(role):
+    """Set the thread counts for role. Call before importing numpy or TensorFlow."""
+    chosen = settings(role)
+    if chosen is None:
+        return None
+    for name in BLAS_VARIABLES:
+        os.environ.setdefault(name, str(chosen["blas"]))
+    os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(chosen["intra_op"]))
+    os.environ.setdefault("TF_NUM_INTEROP_THREADS", str(chosen["inter_op"]))
+    if "tensorflow" in sys.modules:
+        # Too late for the environment, but not yet for the runtime if nothing has run.
+        import tensorflow as tf
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(int(os.environ["TF_NUM_INTRAOP_THREADS"]))
+            tf.config.threading.set_inter_op_parallelism_threads(int(os.environ["TF_NUM_INTEROP_THREADS"]))
+        except RuntimeError:
+            print("TensorFlow is already running, its thread pools keep their size")
+    print(f"{role} threads: TensorFlow intra-op {os.environ['TF_NUM_INTRAOP_THREADS']}, "
+          f"inter-op {os.environ['TF_NUM_INTEROP_THREADS']}, BLAS {os.environ[BLAS_VARIABLES[0]]}")
+    return chosen